@@ -0,0 +1,120 @@
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from websockets.legacy.server import WebSocketServerProtocol
+from . import pools
+from . import resume
+from .auth import verify_firebase_token
+from .config import (
+    MAX_CONNECTIONS, MAX_CONNECTIONS_PER_IP, HANDSHAKE_AUTH_REQUIRED, TRUST_FORWARDED_FOR,
+)
+
+# Admission at the HTTP upgrade, before the server creates a session, outbox or
+# handler task. Connections over the global or per-IP cap get a 503/429, and a
+# token offered with the upgrade is verified there, so bad credentials get a 401
+# instead of a socket that lingers until it sends a join frame.
+#
+# Clients authenticate with `Authorization: Bearer <Firebase ID token>` or, since
+# browsers can't set headers on a WebSocket, `?token=`; `?roomId=` joins that room
+# as soon as the connection opens. `?resumeToken=` resumes after a drain. Without
+# any of these (unless HANDSHAKE_AUTH_REQUIRED) the first frame must still be a
+# join, which chat_handler waits JOIN_TIMEOUT for. Counts are per process.
+
+RETRY_AFTER = "5"
+
+_open = 0   # admitted connections, handshaking or open
+_by_ip = {}
+
+stats = {
+    "admitted": 0, "handshake_auth": 0, "handshake_resume": 0,
+    "rejected_global": 0, "rejected_ip": 0, "rejected_auth": 0, "shed": 0, "join_timeouts": 0,
+}
+
+def _reject(status, reason, retry=False):
+    headers = [("Content-Type", "text/plain")]
+    if retry:
+        headers.append(("Retry-After", RETRY_AFTER))
+    return status, headers, f"{reason}\n".encode()
+
+def open_connections():
+    return _open
+
+class ChatServerProtocol(WebSocketServerProtocol):
+    """Server protocol that admits, and optionally authenticates, the upgrade request."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client_ip = None
+        self._counted = False
+        # (userId, roomId or None, resume-since or None) once authenticated at the handshake.
+        self.identity = None
+
+    async def process_request(self, path, request_headers):
+        response = await super().process_request(path, request_headers)  # /health, /metrics
+        if response is not None:
+            return response
+
+        ip = self._client_ip(request_headers)
+        if MAX_CONNECTIONS and _open >= MAX_CONNECTIONS:
+            stats["rejected_global"] += 1
+            return _reject(HTTPStatus.SERVICE_UNAVAILABLE, "Server full", retry=True)
+        if MAX_CONNECTIONS_PER_IP and _by_ip.get(ip, 0) >= MAX_CONNECTIONS_PER_IP:
+            stats["rejected_ip"] += 1
+            return _reject(HTTPStatus.TOO_MANY_REQUESTS, "Too many connections", retry=True)
+        self._count(ip)
+
+        params = parse_qs(urlsplit(path).query)
+        room_id = params.get("roomId", [None])[0]
+        resume_token = params.get("resumeToken", [None])[0]
+        authorization = request_headers.get("Authorization", "")
+        token = authorization[7:] if authorization.startswith("Bearer ") else params.get("token", [None])[0]
+
+        if resume_token:
+            resumed = resume.verify(resume_token)
+            if not resumed:
+                stats["rejected_auth"] += 1
+                return _reject(HTTPStatus.UNAUTHORIZED, "Invalid resume token")
+            stats["handshake_resume"] += 1
+            self.identity = resumed
+        elif token:
+            try:
+                claims = await verify_firebase_token(token)
+            except (pools.Saturated, TimeoutError):
+                stats["shed"] += 1
+                return _reject(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy", retry=True)
+            if not claims:
+                stats["rejected_auth"] += 1
+                return _reject(HTTPStatus.UNAUTHORIZED, "Invalid authentication token")
+            stats["handshake_auth"] += 1
+            self.identity = (claims["user_id"], room_id, None)
+        elif HANDSHAKE_AUTH_REQUIRED:
+            stats["rejected_auth"] += 1
+            return _reject(HTTPStatus.UNAUTHORIZED, "Authentication required")
+        stats["admitted"] += 1
+        return None
+
+    def _client_ip(self, request_headers):
+        forwarded = request_headers.get("X-Forwarded-For") if TRUST_FORWARDED_FOR else None
+        if forwarded:
+            # The proxy appends the peer it saw; that's the last hop we can trust.
+            return forwarded.rsplit(",", 1)[-1].strip()
+        address = self.remote_address
+        return address[0] if address else None
+
+    def _count(self, ip):
+        global _open
+        _open += 1
+        _by_ip[ip] = _by_ip.get(ip, 0) + 1
+        self.client_ip = ip
+        self._counted = True
+
+    def connection_lost(self, exc):
+        global _open
+        if self._counted:
+            self._counted = False
+            _open -= 1
+            remaining = _by_ip[self.client_ip] - 1
+            if remaining:
+                _by_ip[self.client_ip] = remaining
+            else:
+                del _by_ip[self.client_ip]
+        super().connection_lost(exc)
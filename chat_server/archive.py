@@ -0,0 +1,193 @@
+"""Cold tier: retired message partitions stored as Parquet files in ARCHIVE_DIR.
+
+Each file holds one partition, sorted by (roomId, timestamp, id) so a room's
+rows sit in a few row groups and filtered reads skip the rest. Files are named
+after the partition's upper bound, `messages_until_YYYYMMDD.parquet`; ranges are
+contiguous, so a file covers [previous file's bound, its own bound). The
+footer lists the rooms a file holds, so history reads for a room skip the
+files it has no rows in without opening them again.
+
+pyarrow is optional and only imported once the archive is used.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime, UTC
+from . import pools
+from .config import ARCHIVE_DIR
+
+EXPORT_BATCH_ROWS = 50000
+FILE_PREFIX = "messages_until_"
+FILE_SUFFIX = ".parquet"
+ROOMS_KEY = b"chat.rooms"
+
+# path -> frozenset of the roomIds in that file. Files never change once in place.
+_room_sets = {}
+
+stats = {"exported_files": 0, "exported_rows": 0, "reads": 0, "read_rows": 0, "read_ms": 0.0}
+
+def enabled():
+    return bool(ARCHIVE_DIR)
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+def _schema(pa):
+    return pa.schema([
+        ("roomid", pa.string()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("id", pa.int64()),
+        ("userid", pa.string()),
+        ("text", pa.string()),
+        ("seq", pa.int64()),
+    ])
+
+def _path(upper):
+    return os.path.join(ARCHIVE_DIR, f"{FILE_PREFIX}{upper:%Y%m%d}{FILE_SUFFIX}")
+
+def _files():
+    """[(upper bound, path)] of archived partitions, oldest first."""
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except FileNotFoundError:
+        return []
+    files = []
+    for name in names:
+        if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX):
+            day = name[len(FILE_PREFIX):-len(FILE_SUFFIX)]
+            files.append((datetime.strptime(day, "%Y%m%d").replace(tzinfo=UTC), os.path.join(ARCHIVE_DIR, name)))
+    files.sort()
+    return files
+
+def horizon():
+    """Upper bound of the newest archived partition; everything older is in the archive."""
+    files = _files()
+    return files[-1][0] if files else None
+
+async def export_partition(conn, table, upper):
+    """Stream a partition's rows into a Parquet file. Returns the number of rows written.
+
+    The file is written under a temporary name and renamed into place, so a
+    crash never leaves a partial file that readers would trust.
+    """
+    pa, pq = _pyarrow()
+    schema = _schema(pa)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = _path(upper)
+    tmp_path = path + ".tmp"
+    writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+    rows_written = 0
+    rooms = set()
+    try:
+        async with conn.transaction():
+            cursor = await conn.cursor(
+                f"SELECT roomId, timestamp, id, userId, text, seq FROM {table} ORDER BY roomId, timestamp, id"
+            )
+            while True:
+                rows = await cursor.fetch(EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+                batch = pa.Table.from_arrays([pa.array([row[i] for row in rows], schema.field(i).type)
+                                              for i in range(len(schema))], schema=schema)
+                await pools.archive.run(writer.write_table, batch)
+                rows_written += len(rows)
+                rooms.update(row[0] for row in rows)
+        writer.add_key_value_metadata({ROOMS_KEY: json.dumps(sorted(rooms))})
+    except BaseException:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+    writer.close()
+    os.replace(tmp_path, path)
+    stats["exported_files"] += 1
+    stats["exported_rows"] += rows_written
+    return rows_written
+
+def _load_room_sets(paths):
+    _, pq = _pyarrow()
+    for path in paths:
+        rooms = (pq.read_metadata(path).metadata or {}).get(ROOMS_KEY)
+        if rooms is not None:
+            _room_sets[path] = frozenset(json.loads(rooms))
+        else:
+            # Exported before files listed their rooms; work it out once.
+            column = pq.read_table(path, columns=["roomid"]).column("roomid")
+            _room_sets[path] = frozenset(column.unique().to_pylist())
+
+async def _files_for(roomId):
+    """_files(), each with a flag for whether it holds any of the room's rows."""
+    files = _files()
+    missing = [path for _, path in files if path not in _room_sets]
+    if missing:
+        await pools.archive.run(_load_room_sets, missing)
+    return [(upper, path, roomId in _room_sets[path]) for upper, path in files]
+
+def _read(path, roomId, filters):
+    _, pq = _pyarrow()
+    # Files exported before sequence numbers existed have no seq column.
+    has_seq = "seq" in pq.read_schema(path).names
+    columns = ["id", "userid", "text", "timestamp"] + (["seq"] if has_seq else [])
+    table = pq.read_table(path, columns=columns, filters=[("roomid", "==", roomId)] + filters)
+    values = [table.column(name).to_pylist() for name in columns]
+    if not has_seq:
+        values.append([None] * table.num_rows)
+    return list(zip(*values))
+
+async def fetch_older(roomId, timestamp, id, limit):
+    """Up to `limit` archived rows older than (timestamp, id), newest first.
+
+    A None timestamp means "from the newest archived row". Rows are
+    (id, userId, text, timestamp, seq) tuples like db.py's records.
+    """
+    started = time.perf_counter()
+    files = await _files_for(roomId)
+    result = []
+    for i in range(len(files) - 1, -1, -1):
+        if not files[i][2]:
+            continue
+        lower = files[i - 1][0] if i else None
+        if timestamp is not None and lower is not None and lower > timestamp:
+            continue  # the whole file is newer than the cursor
+        filters = [("timestamp", "<=", timestamp)] if timestamp is not None else []
+        rows = await pools.archive.run(_read, files[i][1], roomId, filters)
+        if timestamp is not None:
+            rows = [row for row in rows if (row[3], row[0]) < (timestamp, id)]
+        rows.sort(key=lambda row: (row[3], row[0]), reverse=True)
+        result += rows[:limit - len(result)]
+        if len(result) >= limit:
+            break
+    _count_read(started, result)
+    return result
+
+async def fetch_newer(roomId, timestamp, id, limit):
+    """Up to `limit` archived rows newer than (timestamp, id), oldest first."""
+    started = time.perf_counter()
+    result = []
+    for upper, path, has_room in await _files_for(roomId):
+        if not has_room or upper <= timestamp:
+            continue  # the whole file is older than the cursor
+        rows = await pools.archive.run(_read, path, roomId, [("timestamp", ">=", timestamp)])
+        rows = [row for row in rows if (row[3], row[0]) > (timestamp, id)]
+        rows.sort(key=lambda row: (row[3], row[0]))
+        result += rows[:limit - len(result)]
+        if len(result) >= limit:
+            break
+    _count_read(started, result)
+    return result
+
+def _count_read(started, rows):
+    stats["reads"] += 1
+    stats["read_rows"] += len(rows)
+    stats["read_ms"] += (time.perf_counter() - started) * 1000
+
+def check_available():
+    """Log and return False if ARCHIVE_DIR is set but pyarrow isn't installed."""
+    try:
+        _pyarrow()
+        return True
+    except ImportError:
+        logging.error("ARCHIVE_DIR is set but pyarrow is not installed; partitions will not be retired.")
+        return False
@@ -1,15 +1,137 @@
 import logging
 import asyncio
-from google.oauth2 import id_token
-from google.auth.transport import requests
-from config import FIREBASE_PROJECT_ID
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from . import metrics
+from . import pools
+from .config import FIREBASE_PROJECT_ID, FIREBASE_CERTS_URL, AUTH_CACHE_MAX
 
-def _verify_firebase_token_blocking(token):
+# Firebase ID tokens are verified locally against Google's public signing certs.
+# The certs are cached for as long as their Cache-Control max-age allows, and
+# verified tokens are memoized by hash until they expire. requests and
+# google-auth are imported on first use; together they dominate import time.
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+_DEFAULT_CERTS_MAX_AGE = 3600
+# Unknown key ids force a refetch at most this often, so forged tokens can't hammer Google.
+_MIN_FORCED_REFRESH = 60
+_ISSUER = f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}"
+
+_certs = None
+_certs_expiry = 0.0
+_certs_fetched_at = 0.0
+_certs_lock = None
+
+# sha256(token) -> decoded claims, least recently used first
+_verified = OrderedDict()
+_inflight = {}
+
+stats = {"hits": 0, "misses": 0, "coalesced": 0, "failures": 0, "shed": 0, "cert_fetches": 0}
+
+def _fetch_certs_blocking():
+    import requests
+    response = requests.get(FIREBASE_CERTS_URL, timeout=5)
+    response.raise_for_status()
+    match = _MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+    max_age = int(match.group(1)) if match else _DEFAULT_CERTS_MAX_AGE
+    return response.json(), max_age
+
+async def _get_certs(force=False):
+    global _certs, _certs_expiry, _certs_fetched_at, _certs_lock
+    if not force and _certs is not None and time.time() < _certs_expiry:
+        return _certs
+    if _certs_lock is None:
+        _certs_lock = asyncio.Lock()
+    async with _certs_lock:
+        # Another task may have refreshed the certs while we waited for the lock.
+        if _certs is not None and time.time() < _certs_expiry and not force:
+            return _certs
+        if force and time.time() - _certs_fetched_at < _MIN_FORCED_REFRESH:
+            return _certs
+        certs, max_age = await pools.auth.run(_fetch_certs_blocking)
+        stats["cert_fetches"] += 1
+        _certs_fetched_at = time.time()
+        _certs, _certs_expiry = certs, _certs_fetched_at + max_age
+        logging.info(f"Fetched {len(certs)} Firebase signing certs (max-age {max_age}s)")
+        return _certs
+
+def _decode(token, certs):
+    from google.auth import jwt
+    claims = jwt.decode(token, certs=certs, audience=FIREBASE_PROJECT_ID)
+    if claims.get("iss") != _ISSUER:
+        raise ValueError(f"Token has wrong issuer: {claims.get('iss')}")
+    if not claims.get("sub"):
+        raise ValueError("Token has no subject")
+    return claims
+
+async def _verify(token):
+    # Signature checks are CPU-bound, so they run on the auth pool, not the loop.
+    certs = await _get_certs()
     try:
-        return id_token.verify_firebase_token(token, requests.Request(), audience=FIREBASE_PROJECT_ID)
+        return await pools.auth.run(_decode, token, certs)
+    except ValueError:
+        # The signing key may have rotated since the certs were cached.
+        from google.auth import jwt
+        kid = jwt.decode_header(token).get("kid")
+        if kid in certs or time.time() - _certs_fetched_at < _MIN_FORCED_REFRESH:
+            raise
+        return await pools.auth.run(_decode, token, await _get_certs(force=True))
+
+def _remember(key, claims):
+    _verified[key] = claims
+    while len(_verified) > AUTH_CACHE_MAX:
+        _verified.popitem(last=False)
+
+async def verify_firebase_token(token):
+    """Claims for a valid token, else None. Raises pools.Saturated or TimeoutError when overloaded."""
+    started = time.perf_counter()
+    try:
+        return await _verify_cached(token)
+    finally:
+        metrics.VERIFY_SECONDS.observe(time.perf_counter() - started)
+
+async def _verify_cached(token):
+    # JWTs are ASCII; this also keeps lone surrogates away from token.encode().
+    if not isinstance(token, str) or not token.isascii():
+        return None
+    key = hashlib.sha256(token.encode()).digest()
+    claims = _verified.get(key)
+    if claims is not None:
+        if claims["exp"] > time.time():
+            stats["hits"] += 1
+            _verified.move_to_end(key)
+            return claims
+        del _verified[key]
+
+    # Concurrent verifications of the same token share one attempt.
+    task = _inflight.get(key)
+    if task is not None:
+        stats["coalesced"] += 1
+    else:
+        stats["misses"] += 1
+        task = _inflight[key] = asyncio.ensure_future(_verify(token))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    try:
+        claims = await asyncio.shield(task)
     except ValueError as e:
-        logging.warning(f"Token verification failed: {e}")
+        stats["failures"] += 1
+        logging.warning("Token verification failed: %s", e, extra={"event": "auth.failed"})
+        return None
+    except (pools.Saturated, TimeoutError):
+        stats["shed"] += 1
+        raise
+    except Exception as e:
+        stats["failures"] += 1
+        logging.error("Token verification error: %s", e, extra={"event": "auth.error"})
         return None
+    _remember(key, claims)
+    return claims
 
-async def verify_firebase_token(token):
-    return await asyncio.to_thread(_verify_firebase_token_blocking, token)
+async def prefetch_certs():
+    """Warm the signing-cert cache so the first join doesn't pay for the HTTPS fetch."""
+    try:
+        await _get_certs()
+    except Exception as e:
+        logging.warning(f"Could not prefetch Firebase signing certs: {e}")
@@ -0,0 +1,348 @@
+"""Load generator and latency benchmark for the chat server.
+
+Starts bench_server.py (main.main with an in-memory DB) against a local fake
+key server, drives simulated clients through join, message, room-switch and
+load_chat scenarios, and prints a JSON report that can be diffed between runs.
+
+    python -m chat_server.bench --clients 2000 --rooms 50 --messages 20 --output before.json
+
+Compression modes are compared on CPU per broadcast and bytes on the wire, e.g.
+
+    python -m chat_server.bench --message-bytes 1024 --compression off
+    python -m chat_server.bench --message-bytes 1024 --shared-compression 0
+    python -m chat_server.bench --message-bytes 1024 --shared-compression 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+import websockets
+from .fake_keyserver import FakeKeyServer
+
+PROJECT_ID = "bench-project"
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    last = len(samples) - 1
+
+    def at(q):
+        return round(samples[min(last, int(q * len(samples)))] * 1000, 3)
+
+    return {
+        "count": len(samples),
+        "p50_ms": at(0.50),
+        "p99_ms": at(0.99),
+        "p999_ms": at(0.999),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+def process_tree(pid):
+    """The server process and its children (worker mode)."""
+    pids = [pid]
+    try:
+        children = open(f"/proc/{pid}/task/{pid}/children").read().split()
+        pids += [int(child) for child in children]
+    except OSError:
+        pass
+    return pids
+
+def rss_bytes(pid):
+    """Resident set size of a process and its children (worker mode)."""
+    total = 0
+    for p in process_tree(pid):
+        try:
+            for line in open(f"/proc/{p}/status"):
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+def cpu_seconds(pid):
+    """User plus system CPU time used by the server processes."""
+    total = 0
+    for p in process_tree(pid):
+        try:
+            fields = open(f"/proc/{p}/stat").read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError):
+            pass
+    return total / os.sysconf("SC_CLK_TCK")
+
+def loopback_bytes():
+    """Bytes sent over the loopback interface; client and server traffic both count."""
+    try:
+        for line in open("/proc/net/dev"):
+            name, _, counters = line.partition(":")
+            if name.strip() == "lo":
+                return int(counters.split()[8])
+    except OSError:
+        pass
+    return 0
+
+# Repeated chat-like text so compression has something realistic to work on.
+FILLER = "the quick brown fox jumps over the lazy dog, then naps in the sun. "
+
+class Client:
+    """One simulated user: a socket plus a reader task that timestamps inbound frames."""
+
+    def __init__(self, index, user_id, room_id):
+        self.index = index
+        self.user_id = user_id
+        self.room_id = room_id
+        self.websocket = None
+        self.reader = None
+        self.latencies = None
+        self.received = 0
+        self.waiters = {}
+
+    def expect(self, kind):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[kind] = future
+        return future
+
+    async def read(self):
+        try:
+            async for raw in self.websocket:
+                now = time.perf_counter()
+                self.received += 1
+                data = json.loads(raw)
+                kind = data.get("type")
+                if kind == "message" and self.latencies is not None:
+                    sent_at = float(data["text"].split(":", 1)[1].split(" ", 1)[0])
+                    self.latencies.append(now - sent_at)
+                elif kind == "announcement" and self.user_id in data.get("joined", ()):
+                    kind = "own_announcement"
+                future = self.waiters.pop(kind, None)
+                if future and not future.done():
+                    future.set_result(now)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+async def connect_all(clients, url, tokens, concurrency, compression):
+    semaphore = asyncio.Semaphore(concurrency)
+    join_latencies = []
+
+    async def connect(client):
+        async with semaphore:
+            started = time.perf_counter()
+            client.websocket = await websockets.connect(
+                url, max_queue=None, open_timeout=60, compression=compression
+            )
+            joined = client.expect("own_announcement")
+            client.reader = asyncio.create_task(client.read())
+            await client.websocket.send(json.dumps({
+                "type": "join", "token": tokens[client.index], "roomId": client.room_id
+            }))
+            join_latencies.append(await asyncio.wait_for(joined, 60) - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    elapsed = time.perf_counter() - started
+    return {
+        "connections": len(clients),
+        "seconds": round(elapsed, 3),
+        "connects_per_sec": round(len(clients) / elapsed, 1),
+        "join_latency": percentiles(join_latencies),
+    }
+
+async def run_messages(clients, messages_per_client, interval, rooms, message_bytes, server_pid):
+    latencies = []
+    padding = (" " + FILLER * (message_bytes // len(FILLER) + 1))[:message_bytes] if message_bytes else ""
+    for client in clients:
+        client.latencies = latencies
+        client.received = 0
+    members = {}
+    for client in clients:
+        members[client.room_id] = members.get(client.room_id, 0) + 1
+
+    async def send(client):
+        for i in range(messages_per_client):
+            await client.websocket.send(json.dumps({
+                "type": "message", "text": f"{client.index}.{i}:{time.perf_counter()}{padding}"
+            }))
+            await asyncio.sleep(interval)
+
+    expected = sum(messages_per_client * (members[c.room_id] - 1) for c in clients)
+    cpu_started = cpu_seconds(server_pid)
+    wire_started = loopback_bytes()
+    started = time.perf_counter()
+    await asyncio.gather(*(send(client) for client in clients))
+    deadline = time.perf_counter() + 30
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    cpu = cpu_seconds(server_pid) - cpu_started
+    wire = loopback_bytes() - wire_started
+    sent = messages_per_client * len(clients)
+    for client in clients:
+        client.latencies = None
+    return {
+        "sent": messages_per_client * len(clients),
+        "expected_deliveries": expected,
+        "delivered": len(latencies),
+        "seconds": round(elapsed, 3),
+        "sent_per_sec": round(messages_per_client * len(clients) / elapsed, 1),
+        "delivered_per_sec": round(len(latencies) / elapsed, 1),
+        "fanout_latency": percentiles(latencies),
+        "server_cpu_seconds": round(cpu, 3),
+        "server_cpu_ms_per_broadcast": round(cpu * 1000 / sent, 4) if sent else 0,
+        "loopback_bytes": wire,
+        "loopback_bytes_per_delivery": round(wire / len(latencies), 1) if latencies else 0,
+    }
+
+async def run_room_switch(clients, rooms, switches):
+    latencies = []
+
+    async def switch(client):
+        for _ in range(switches):
+            current = int(client.room_id.split("-")[1])
+            client.room_id = f"room-{(current + 1) % rooms}"
+            joined = client.expect("own_announcement")
+            started = time.perf_counter()
+            await client.websocket.send(json.dumps({"type": "join", "roomId": client.room_id}))
+            latencies.append(await asyncio.wait_for(joined, 60) - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(switch(client) for client in clients))
+    elapsed = time.perf_counter() - started
+    return {
+        "switches": len(latencies),
+        "switches_per_sec": round(len(latencies) / elapsed, 1),
+        "switch_latency": percentiles(latencies),
+    }
+
+async def run_load_chat(clients, requests_per_client, limit):
+    latencies = []
+
+    async def load(client):
+        for _ in range(requests_per_client):
+            answered = client.expect("chat_history")
+            started = time.perf_counter()
+            await client.websocket.send(json.dumps({"type": "load_chat", "limit": limit}))
+            latencies.append(await asyncio.wait_for(answered, 60) - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(load(client) for client in clients))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "load_chat_latency": percentiles(latencies),
+    }
+
+def start_server(args, key_server):
+    env = {
+        **os.environ,
+        "SERVER_HOST": args.host,
+        "SERVER_PORT": str(args.port),
+        "DATABASE_URL": "memory://",
+        "FIREBASE_PROJECT_ID": PROJECT_ID,
+        "FIREBASE_CERTS_URL": key_server.url,
+        # Joins are acknowledged by the presence announcement, so keep it on for every room size.
+        "PRESENCE_MAX_ROOM_SIZE": os.environ.get("PRESENCE_MAX_ROOM_SIZE", str(10**9)),
+        # Simulated clients send faster than the per-user defaults allow.
+        "RATE_LIMIT_ENABLED": os.environ.get("RATE_LIMIT_ENABLED", "0"),
+        # ...and every simulated client connects from the same address.
+        "MAX_CONNECTIONS_PER_IP": os.environ.get("MAX_CONNECTIONS_PER_IP", "0"),
+        "WS_COMPRESSION": args.compression,
+        "WS_SHARED_COMPRESSION": "1" if args.shared_compression else "0",
+    }
+    command = [sys.executable, "-m", "chat_server.bench_server"]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://{args.host}:{args.port}/health", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("bench server did not become healthy")
+
+async def run(args):
+    key_server = FakeKeyServer(PROJECT_ID).start()
+    tokens = [key_server.mint_token(f"user-{i}") for i in range(args.clients)]
+    server = start_server(args, key_server)
+    url = f"ws://{args.host}:{args.port}"
+    clients = [Client(i, f"user-{i}", f"room-{i % args.rooms}") for i in range(args.clients)]
+    try:
+        rss_idle = rss_bytes(server.pid)
+        client_compression = "deflate" if args.compression == "deflate" else None
+        results = {"connect": await connect_all(clients, url, tokens, args.connect_concurrency, client_compression)}
+        await asyncio.sleep(1)
+        rss_connected = rss_bytes(server.pid)
+        results["memory"] = {
+            "rss_idle_bytes": rss_idle,
+            "rss_connected_bytes": rss_connected,
+            "bytes_per_connection": round((rss_connected - rss_idle) / args.clients),
+        }
+        if "message" in args.scenarios:
+            results["message"] = await run_messages(
+                clients, args.messages, args.interval, args.rooms, args.message_bytes, server.pid
+            )
+        if "room_switch" in args.scenarios:
+            results["room_switch"] = await run_room_switch(clients, args.rooms, args.switches)
+        if "load_chat" in args.scenarios:
+            results["load_chat"] = await run_load_chat(clients, args.load_chat, args.limit)
+        for client in clients:
+            await client.websocket.close()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        key_server.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat server load and latency benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=10, help="messages sent per client")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between a client's messages")
+    parser.add_argument("--message-bytes", type=int, default=0, help="filler text appended to each message")
+    parser.add_argument("--compression", choices=["deflate", "off"], default="deflate",
+                        help="permessage-deflate on both ends, or off")
+    parser.add_argument("--shared-compression", type=int, choices=[0, 1], default=1,
+                        help="compress each broadcast once for all recipients (server WS_SHARED_COMPRESSION)")
+    parser.add_argument("--switches", type=int, default=2, help="room switches per client")
+    parser.add_argument("--load-chat", type=int, default=2, help="load_chat requests per client")
+    parser.add_argument("--limit", type=int, default=50, help="load_chat page size")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--scenarios", default="message,room_switch,load_chat")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    args.scenarios = set(args.scenarios.split(","))
+
+    # Each simulated client holds a socket in this process and one in the server.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    results = asyncio.run(run(args))
+    report = {
+        "params": {k: v if not isinstance(v, set) else sorted(v) for k, v in vars(args).items() if k != "output"},
+        "python": platform.python_version(),
+        "websockets": websockets.__version__,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
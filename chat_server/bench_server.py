@@ -0,0 +1,24 @@
+"""Run main.main with the in-memory DB stand-in, for benchmarks.
+
+Token verification is left untouched: point FIREBASE_CERTS_URL at a
+fake_keyserver.FakeKeyServer and mint tokens from it. bench.py does both.
+
+    python -m chat_server.bench_server [--workers N]
+"""
+import asyncio
+import sys
+from . import db
+from . import memory_db
+
+# Patch before anything imports names out of db.
+for name in memory_db.__all__:
+    setattr(db, name, getattr(memory_db, name))
+
+from . import main  # noqa: E402
+
+if __name__ == "__main__":
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 1
+    if workers > 1:
+        main.run_workers(workers)
+    else:
+        asyncio.run(main.main())
@@ -0,0 +1,238 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import logging
+import os
+import uuid
+from .config import BROKER_URL, NODE_ID
+
+# Multi-node room fan-out. Each node subscribes to the channels of rooms it has
+# local members in and publishes every local broadcast for other nodes to pick up.
+# Same-node members are served directly by rooms.deliver_local, never via the broker.
+
+CHANNEL_PREFIX = "chat:room:"
+
+stats = {"published": 0, "received": 0, "own_echoes": 0, "invalid": 0, "delivery_errors": 0}
+
+class Broker(ABC):
+    """Interface for a pub/sub backend carrying room broadcasts between nodes."""
+
+    @abstractmethod
+    async def start(self, on_message):
+        """on_message(channel, data) is called for every message on a subscribed channel."""
+
+    @abstractmethod
+    async def subscribe(self, channel):
+        pass
+
+    @abstractmethod
+    async def unsubscribe(self, channel):
+        pass
+
+    @abstractmethod
+    async def publish(self, channel, data):
+        pass
+
+    async def close(self):
+        pass
+
+class RedisBroker(Broker):
+    """Redis pub/sub backend."""
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self._pubsub = self._redis.pubsub()
+        self._reader = None
+
+    async def start(self, on_message):
+        self._reader = asyncio.create_task(self._read(on_message))
+
+    async def _read(self, on_message):
+        while True:
+            if not self._pubsub.subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                logging.error(f"Broker read failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if message is not None:
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                try:
+                    on_message(channel, message["data"])
+                except Exception:
+                    # One bad message must not end the reader, or the node goes deaf.
+                    stats["delivery_errors"] += 1
+                    logging.exception("Broker delivery on '%s' failed", channel,
+                                      extra={"event": "broker.delivery_error"})
+
+    async def subscribe(self, channel):
+        await self._pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel):
+        await self._pubsub.unsubscribe(channel)
+
+    async def publish(self, channel, data):
+        await self._redis.publish(channel, data)
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+class LocalHub:
+    """In-process stand-in for a Redis server, shared by LocalBroker instances."""
+
+    def __init__(self):
+        self.channels = {}
+
+# BROKER_URL=local: every node started in this process shares this hub.
+default_hub = LocalHub()
+
+class LocalBroker(Broker):
+    """Broker with Redis pub/sub semantics backed by a LocalHub, for tests and development."""
+
+    def __init__(self, hub=None):
+        self.hub = hub or default_hub
+        self._on_message = None
+
+    async def start(self, on_message):
+        self._on_message = on_message
+
+    async def subscribe(self, channel):
+        self.hub.channels.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, channel):
+        subscribers = self.hub.channels.get(channel)
+        if subscribers:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.hub.channels[channel]
+
+    async def publish(self, channel, data):
+        loop = asyncio.get_running_loop()
+        for subscriber in self.hub.channels.get(channel, ()):
+            loop.call_soon(subscriber._on_message, channel, data)
+
+    async def close(self):
+        for channel in list(self.hub.channels):
+            await self.unsubscribe(channel)
+
+def create_broker(url):
+    if url == "local":
+        return LocalBroker()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported BROKER_URL: {url}")
+
+class Node:
+    """One node's use of a broker: its id, its room subscriptions and its outgoing queue.
+
+    Subscribe/unsubscribe/publish operations are queued and applied by one task,
+    so they reach the broker in order and the broadcasting handler never waits on it.
+    on_message(roomId, message) receives broadcasts from other nodes; the node's
+    own publications echoed back by the broker are dropped.
+    """
+
+    def __init__(self, broker, on_message, name=None):
+        self.broker = broker
+        self.id = f"{name or 'node'}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._on_message = on_message
+        self._ops = asyncio.Queue()
+        self._task = None
+
+    async def start(self):
+        await self.broker.start(self._receive)
+        self._task = asyncio.create_task(self._apply_ops())
+
+    def _receive(self, channel, data):
+        try:
+            envelope = json.loads(data)
+        except ValueError:
+            envelope = None
+        if not isinstance(envelope, dict) or not isinstance(envelope.get("node"), str) \
+                or not isinstance(envelope.get("message"), dict):
+            stats["invalid"] += 1
+            logging.warning("Dropping malformed broker message on '%s'", channel,
+                            extra={"event": "broker.invalid"})
+            return
+        if envelope["node"] == self.id:
+            stats["own_echoes"] += 1
+            return
+        stats["received"] += 1
+        self._on_message(channel[len(CHANNEL_PREFIX):], envelope["message"])
+
+    async def _apply_ops(self):
+        while True:
+            op, channel, data = await self._ops.get()
+            try:
+                if op == "publish":
+                    await self.broker.publish(channel, data)
+                elif op == "subscribe":
+                    await self.broker.subscribe(channel)
+                else:
+                    await self.broker.unsubscribe(channel)
+            except Exception as e:
+                logging.error(f"Broker {op} on '{channel}' failed: {e}")
+            finally:
+                self._ops.task_done()
+
+    def room_opened(self, roomId):
+        self._ops.put_nowait(("subscribe", CHANNEL_PREFIX + roomId, None))
+
+    def room_closed(self, roomId):
+        self._ops.put_nowait(("unsubscribe", CHANNEL_PREFIX + roomId, None))
+
+    def publish(self, roomId, message):
+        data = json.dumps({"node": self.id, "message": message})
+        self._ops.put_nowait(("publish", CHANNEL_PREFIX + roomId, data))
+        stats["published"] += 1
+
+    async def flush(self):
+        """Wait until every queued operation has reached the broker."""
+        await self._ops.join()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self.broker.close()
+
+# This process's node; None when no broker is configured.
+_node = None
+
+async def start_broker(on_message, url=BROKER_URL):
+    """Connect to the broker; on_message(roomId, message) receives broadcasts from other nodes."""
+    global _node
+    # Created here rather than at import so forked workers each get their own id.
+    _node = Node(create_broker(url), on_message, NODE_ID)
+    await _node.start()
+    logging.info(f"Node {_node.id} connected to room broker")
+
+def room_opened(roomId):
+    if _node is not None:
+        _node.room_opened(roomId)
+
+def room_closed(roomId):
+    """Unsubscribe from a room's channel; returns whether there was a broker to unsubscribe from."""
+    if _node is None:
+        return False
+    _node.room_closed(roomId)
+    return True
+
+def publish(roomId, message):
+    """Relay a room broadcast to other nodes. No-op when no broker is configured."""
+    if _node is not None:
+        _node.publish(roomId, message)
+
+async def stop_broker():
+    global _node
+    if _node is None:
+        return
+    await _node.stop()
+    _node = None
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+# Cross-worker room bus: every worker binds a Unix datagram socket in a shared
+# directory and relays broadcasts to its sibling workers' sockets.
+_transport = None
+_peers = []
+_on_message = None
+
+stats = {"published": 0, "received": 0, "send_errors": 0}
+
+# Larger datagrams are rejected by the kernel (default SO_SNDBUF for AF_UNIX).
+MAX_DATAGRAM = 200 * 1024
+
+def worker_socket_path(bus_dir, worker_id):
+    return os.path.join(bus_dir, f"worker-{worker_id}.sock")
+
+class _BusProtocol(asyncio.DatagramProtocol):
+    def datagram_received(self, data, addr):
+        try:
+            roomId, message = json.loads(data)
+        except ValueError:
+            logging.warning("Dropping malformed bus datagram")
+            return
+        stats["received"] += 1
+        _on_message(roomId, message)
+
+    def error_received(self, exc):
+        # A sibling that is starting up or has exited; the message is simply not delivered there.
+        stats["send_errors"] += 1
+
+async def start_bus(bus_dir, worker_id, workers, on_message):
+    """Bind this worker's bus socket and call on_message(roomId, message) for sibling broadcasts."""
+    global _transport, _peers, _on_message
+    _on_message = on_message
+    path = worker_socket_path(bus_dir, worker_id)
+    if os.path.exists(path):
+        os.unlink(path)
+    loop = asyncio.get_running_loop()
+    _transport, _ = await loop.create_datagram_endpoint(
+        _BusProtocol, local_addr=path, family=socket.AF_UNIX
+    )
+    _peers = [worker_socket_path(bus_dir, i) for i in range(workers) if i != worker_id]
+    logging.info(f"Worker {worker_id} joined room bus at {path}")
+
+def publish(roomId, message):
+    """Relay a room broadcast to all sibling workers. No-op in single-process mode."""
+    if _transport is None or not _peers:
+        return
+    data = json.dumps([roomId, message]).encode()
+    if len(data) > MAX_DATAGRAM:
+        logging.warning(f"Broadcast for room '{roomId}' too large for the worker bus ({len(data)} bytes)")
+        return
+    for peer in _peers:
+        try:
+            _transport.sendto(data, peer)
+        except OSError:
+            stats["send_errors"] += 1
+    stats["published"] += 1
+
+def stop_bus():
+    global _transport
+    if _transport is not None:
+        path = _transport.get_extra_info("sockname")
+        _transport.close()
+        _transport = None
+        if path and os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,108 @@
+import json
+from .config import JSON_CODEC
+
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+
+# WebSocket subprotocols a client may offer; clients that offer none get JSON.
+SUBPROTOCOL_JSON = "chat.json"
+SUBPROTOCOL_MSGPACK = "chat.msgpack"
+SUBPROTOCOLS = [SUBPROTOCOL_MSGPACK, SUBPROTOCOL_JSON]
+
+class StdlibJsonCodec:
+    name = "json"
+
+    def encode(self, payload):
+        return (OP_TEXT, json.dumps(payload).encode("utf-8"))
+
+    def decode(self, data):
+        return json.loads(data)
+
+class OrjsonCodec:
+    name = "json"
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+
+    def encode(self, payload):
+        return (OP_TEXT, self._dumps(payload))
+
+    def decode(self, data):
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError (a ValueError).
+        return self._loads(data)
+
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+def _check_plain(value):
+    """Raise ValueError if a decoded frame holds anything JSON can't carry (bin, ext, Timestamp)."""
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if not isinstance(key, str):
+                    raise ValueError("Map keys must be strings")
+                pending.append(item)
+        elif isinstance(value, list):
+            pending.extend(value)
+        elif not isinstance(value, _PLAIN_TYPES):
+            raise ValueError(f"Unsupported MessagePack type: {type(value).__name__}")
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, payload):
+        return (OP_BINARY, self._packb(payload))
+
+    def decode(self, data):
+        if isinstance(data, str):
+            raise ValueError("Expected a binary frame")
+        try:
+            value = self._unpackb(data)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack frame: {e}") from e
+        # Decoded values end up in payloads for JSON clients too, so only
+        # accept what both encodings can represent.
+        _check_plain(value)
+        return value
+
+def _create_json_codec(name):
+    if name == "stdlib":
+        return StdlibJsonCodec()
+    if name == "orjson":
+        return OrjsonCodec()
+    if name == "auto":
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return StdlibJsonCodec()
+    raise ValueError(f"Unsupported JSON_CODEC: {name}")
+
+JSON = _create_json_codec(JSON_CODEC)
+_msgpack = None
+
+def codec_for(subprotocol):
+    """Codec for a connection's negotiated subprotocol (None means plain JSON)."""
+    global _msgpack
+    if subprotocol == SUBPROTOCOL_MSGPACK:
+        if _msgpack is None:
+            _msgpack = MsgpackCodec()
+        return _msgpack
+    return JSON
+
+def available_subprotocols():
+    """Subprotocols to offer in the handshake; msgpack only if the library is installed."""
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return [SUBPROTOCOL_JSON]
+    return SUBPROTOCOLS
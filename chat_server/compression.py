@@ -0,0 +1,76 @@
+import struct
+import zlib
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from .config import (
+    WS_COMPRESSION, WS_DEFLATE_WINDOW_BITS, WS_DEFLATE_MEM_LEVEL, WS_DEFLATE_LEVEL,
+    WS_SHARED_COMPRESSION,
+)
+
+# permessage-deflate settings, plus frames compressed once per broadcast.
+#
+# websockets compresses every outgoing message separately for each
+# connection. When the server negotiates server_no_context_takeover, each
+# message is deflated from a fresh context, so its compressed bytes depend only
+# on the payload and the negotiated window size. fan_out then compresses once
+# per (codec, window) and writes the same wire frame to every matching
+# connection. Frames smaller than WS_COMPRESSION_MIN_SIZE are sent uncompressed,
+# which the extension allows per message.
+
+if WS_COMPRESSION not in ("deflate", "off"):
+    raise ValueError("WS_COMPRESSION must be 'deflate' or 'off'")
+
+_EMPTY_BLOCK = b"\x00\x00\xff\xff"
+
+stats = {"shared_frames": 0, "shared_recipients": 0, "raw_bytes": 0, "compressed_bytes": 0, "uncompressed_small": 0}
+
+def server_extensions():
+    """Extension factories for websockets.serve (used with compression=None)."""
+    if WS_COMPRESSION == "off":
+        return []
+    return [ServerPerMessageDeflateFactory(
+        server_no_context_takeover=WS_SHARED_COMPRESSION,
+        server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        client_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        compress_settings={"memLevel": WS_DEFLATE_MEM_LEVEL, "level": WS_DEFLATE_LEVEL},
+    )]
+
+def negotiated(websocket):
+    """(deflate in use, shared-frame key) for a connection.
+
+    The key is the negotiated server window size when every message starts from
+    a fresh context, else None.
+    """
+    for extension in getattr(websocket, "extensions", ()):
+        if isinstance(extension, PerMessageDeflate):
+            if extension.local_no_context_takeover:
+                return True, extension.local_max_window_bits
+            return True, None
+    return False, None
+
+def wire_frame(opcode, data, rsv1=False):
+    """Serialize a complete, unmasked server-to-client frame, bypassing the connection's extensions.
+
+    RSV1 marks the payload as deflated (RFC 7692).
+    """
+    head = 0x80 | (0x40 if rsv1 else 0) | opcode
+    length = len(data)
+    if length < 126:
+        header = struct.pack("!BB", head, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", head, 126, length)
+    else:
+        header = struct.pack("!BBQ", head, 127, length)
+    return header + data
+
+def compressed_frame(opcode, data, window_bits):
+    """A wire frame holding `data` deflated exactly as a fresh-context PerMessageDeflate would."""
+    encoder = zlib.compressobj(
+        level=WS_DEFLATE_LEVEL, wbits=-window_bits, memLevel=WS_DEFLATE_MEM_LEVEL
+    )
+    compressed = encoder.compress(data) + encoder.flush(zlib.Z_SYNC_FLUSH)
+    if compressed.endswith(_EMPTY_BLOCK):
+        compressed = compressed[:-4]
+    stats["shared_frames"] += 1
+    stats["raw_bytes"] += len(data)
+    stats["compressed_bytes"] += len(compressed)
+    return wire_frame(opcode, compressed, rsv1=True)
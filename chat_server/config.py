@@ -1,9 +1,166 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+def _load_dotenv():
+    """Load .env from the working directory or the package, if python-dotenv is installed."""
+    try:
+        from dotenv import load_dotenv, find_dotenv
+    except ImportError:
+        return
+    # Variables already set win, so the working directory's .env beats the package's.
+    for path in (find_dotenv(usecwd=True), os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")):
+        if path and os.path.isfile(path):
+            load_dotenv(path)
+
+_load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 SERVER_HOST = os.getenv("SERVER_HOST")
 SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+FIREBASE_CERTS_URL = os.getenv(
+    "FIREBASE_CERTS_URL",
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com",
+)
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", 100000))
+
+# Logging (see logsetup.py). LOG_FORMAT is "json" or "text". Hot-path events are
+# sampled at LOG_SAMPLE_RATE and capped at LOG_EVENT_MAX_PER_SEC each (0 = no cap).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+LOG_EVENT_MAX_PER_SEC = float(os.getenv("LOG_EVENT_MAX_PER_SEC", 50))
+
+# Database pool
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 20))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 10))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", 300))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30))
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+
+# Bounded worker pools (see pools.py): SIZE calls run at once, QUEUE more may
+# wait, the rest are rejected; TIMEOUT (seconds) covers waiting and running.
+# Keep DB_READ_POOL_SIZE + DB_WRITE_POOL_SIZE within DB_POOL_MAX_SIZE so
+# history reads can never hold every connection the writer needs.
+AUTH_POOL_SIZE = int(os.getenv("AUTH_POOL_SIZE", 4))
+AUTH_POOL_QUEUE = int(os.getenv("AUTH_POOL_QUEUE", 500))
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", 10))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 14))
+DB_READ_POOL_QUEUE = int(os.getenv("DB_READ_POOL_QUEUE", 200))
+DB_READ_TIMEOUT = float(os.getenv("DB_READ_TIMEOUT", 10))
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", 4))
+DB_WRITE_POOL_QUEUE = int(os.getenv("DB_WRITE_POOL_QUEUE", 100))
+DB_WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", 30))
+ARCHIVE_POOL_SIZE = int(os.getenv("ARCHIVE_POOL_SIZE", 2))
+ARCHIVE_POOL_QUEUE = int(os.getenv("ARCHIVE_POOL_QUEUE", 50))
+
+# Time-partitioned storage: one partition per UTC day, created PARTITION_PREMAKE_DAYS
+# ahead. Partitions older than MESSAGES_HOT_DAYS are exported to Parquet files in
+# ARCHIVE_DIR and dropped; with no ARCHIVE_DIR they are kept.
+MESSAGES_HOT_DAYS = int(os.getenv("MESSAGES_HOT_DAYS", 30))
+PARTITION_PREMAKE_DAYS = int(os.getenv("PARTITION_PREMAKE_DAYS", 3))
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", 3600))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+
+# Write-behind message persistence
+WRITE_QUEUE_MAX = int(os.getenv("WRITE_QUEUE_MAX", 10000))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 500))
+WRITE_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_FLUSH_INTERVAL_MS", 50))
+# A batch that fails because the database is unavailable is retried, backing off
+# from WRITE_RETRY_BASE_MS to WRITE_RETRY_MAX_MS, until it is stored; meanwhile
+# the queue fills and senders wait. Shutdown gives up after WRITE_STOP_TIMEOUT seconds.
+WRITE_RETRY_BASE_MS = int(os.getenv("WRITE_RETRY_BASE_MS", 100))
+WRITE_RETRY_MAX_MS = int(os.getenv("WRITE_RETRY_MAX_MS", 5000))
+WRITE_STOP_TIMEOUT = float(os.getenv("WRITE_STOP_TIMEOUT", 30))
+
+# In-memory recent-history cache
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", 100))
+HISTORY_CACHE_BUDGET_BYTES = int(os.getenv("HISTORY_CACHE_BUDGET_BYTES", 64 * 1024 * 1024))
+
+# Per-connection buffer limits (bound memory held by each socket)
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", 16))
+WS_READ_LIMIT = int(os.getenv("WS_READ_LIMIT", 16 * 1024))
+WS_WRITE_LIMIT = int(os.getenv("WS_WRITE_LIMIT", 32 * 1024))
+WS_MAX_SIZE = int(os.getenv("WS_MAX_SIZE", 64 * 1024))  # largest inbound frame; bigger ones close with 1009
+MESSAGE_MAX_CHARS = int(os.getenv("MESSAGE_MAX_CHARS", 4000))
+
+# Connection admission (see admission.py). 0 disables a cap. JOIN_TIMEOUT is how
+# long a connection not authenticated at the handshake has to send its join.
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", 50000))
+MAX_CONNECTIONS_PER_IP = int(os.getenv("MAX_CONNECTIONS_PER_IP", 200))
+HANDSHAKE_AUTH_REQUIRED = os.getenv("HANDSHAKE_AUTH_REQUIRED", "0") == "1"
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"  # only behind a proxy that sets it
+JOIN_TIMEOUT = float(os.getenv("JOIN_TIMEOUT", 10))
+
+# permessage-deflate ("deflate" or "off"). With WS_SHARED_COMPRESSION the server
+# negotiates no context takeover, so a broadcast is compressed once for all
+# recipients instead of once per connection. Frames under WS_COMPRESSION_MIN_SIZE
+# bytes are sent uncompressed.
+WS_COMPRESSION = os.getenv("WS_COMPRESSION", "deflate")
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", 12))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", 5))
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", 6))
+WS_COMPRESSION_MIN_SIZE = int(os.getenv("WS_COMPRESSION_MIN_SIZE", 256))
+WS_SHARED_COMPRESSION = os.getenv("WS_SHARED_COMPRESSION", "1") == "1"
+
+# Inbound rate limits (token buckets: sustained rate per second, burst size; rate 0 disables).
+# Clients that stay throttled for RATE_LIMIT_DISCONNECT_AFTER frames in a row are closed.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_DISCONNECT_AFTER = int(os.getenv("RATE_LIMIT_DISCONNECT_AFTER", 200))
+RATE_FRAMES_PER_SEC = float(os.getenv("RATE_FRAMES_PER_SEC", 30))
+RATE_FRAMES_BURST = int(os.getenv("RATE_FRAMES_BURST", 60))
+RATE_MESSAGES_PER_SEC = float(os.getenv("RATE_MESSAGES_PER_SEC", 5))
+RATE_MESSAGES_BURST = int(os.getenv("RATE_MESSAGES_BURST", 10))
+RATE_USER_MESSAGES_PER_SEC = float(os.getenv("RATE_USER_MESSAGES_PER_SEC", 10))
+RATE_USER_MESSAGES_BURST = int(os.getenv("RATE_USER_MESSAGES_BURST", 20))
+RATE_ROOM_MESSAGES_PER_SEC = float(os.getenv("RATE_ROOM_MESSAGES_PER_SEC", 200))
+RATE_ROOM_MESSAGES_BURST = int(os.getenv("RATE_ROOM_MESSAGES_BURST", 400))
+RATE_JOINS_PER_SEC = float(os.getenv("RATE_JOINS_PER_SEC", 1))
+RATE_JOINS_BURST = int(os.getenv("RATE_JOINS_BURST", 5))
+RATE_HISTORY_PER_SEC = float(os.getenv("RATE_HISTORY_PER_SEC", 2))
+RATE_HISTORY_BURST = int(os.getenv("RATE_HISTORY_BURST", 10))
+
+# Per-connection outbound queues
+OUTBOX_MAX_FRAMES = int(os.getenv("OUTBOX_MAX_FRAMES", 1000))
+OUTBOX_OVERFLOW_POLICY = os.getenv("OUTBOX_OVERFLOW_POLICY", "drop_oldest")  # drop_oldest | coalesce | disconnect
+
+# Presence announcements: join/leave events are batched per room over this window,
+# and rooms larger than PRESENCE_MAX_ROOM_SIZE get no per-user announcements.
+PRESENCE_WINDOW_MS = int(os.getenv("PRESENCE_WINDOW_MS", 200))
+PRESENCE_MAX_ROOM_SIZE = int(os.getenv("PRESENCE_MAX_ROOM_SIZE", 500))
+# Presence snapshots list at most this many users per page.
+PRESENCE_PAGE_SIZE = int(os.getenv("PRESENCE_PAGE_SIZE", 500))
+
+# Graceful drain: clients are closed with a reconnect notice spread over
+# DRAIN_SECONDS. With RESUME_SECRET set (shared by every node), the notice
+# carries a resume token valid for RESUME_TTL seconds that skips Firebase
+# verification and replays up to RESUME_MAX_MESSAGES missed messages.
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", 10))
+RESUME_SECRET = os.getenv("RESUME_SECRET")
+RESUME_TTL = int(os.getenv("RESUME_TTL", 300))
+RESUME_MAX_MESSAGES = int(os.getenv("RESUME_MAX_MESSAGES", 200))
+SYNC_MAX_MESSAGES = int(os.getenv("SYNC_MAX_MESSAGES", 500))  # per sync reply; complete=false means ask again
+# Each process reserves a room's sequence numbers SEQ_BLOCK_SIZE at a time and
+# hands them out in memory; a failed reservation is retried every SEQ_RESERVE_RETRY_MS.
+SEQ_BLOCK_SIZE = int(os.getenv("SEQ_BLOCK_SIZE", 100))
+SEQ_RESERVE_RETRY_MS = int(os.getenv("SEQ_RESERVE_RETRY_MS", 1000))
+
+# Full-text search (the "search" request); results per page are capped at SEARCH_MAX_RESULTS.
+SEARCH_MAX_QUERY_CHARS = int(os.getenv("SEARCH_MAX_QUERY_CHARS", 256))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 50))
+HANDOFF_TIMEOUT = float(os.getenv("HANDOFF_TIMEOUT", 30))
+
+# Multi-node fan-out ("redis://host:6379/0", or "local" for the in-process stand-in)
+BROKER_URL = os.getenv("BROKER_URL")
+NODE_ID = os.getenv("NODE_ID")
+
+# Wire codec for JSON clients: "auto" (orjson if installed), "orjson" or "stdlib".
+# Clients opt into MessagePack by offering the "chat.msgpack" subprotocol.
+JSON_CODEC = os.getenv("JSON_CODEC", "auto")
+
+# Profiling (see profiling.py): toggled at runtime with SIGUSR1.
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", 10))
+PROFILE_SLOW_CALLBACK_MS = float(os.getenv("PROFILE_SLOW_CALLBACK_MS", 100))
@@ -1,103 +1,418 @@
 import logging
-from psycopg2 import pool
 import asyncio
+import base64
+import time
+from datetime import datetime
+from . import archive
+from . import metrics
+from . import pools
+from .config import (
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_COMMAND_TIMEOUT,
+    DB_STATEMENT_CACHE_SIZE, DB_MAX_INACTIVE_LIFETIME, DB_HEALTH_CHECK_INTERVAL,
+)
 
 db_pool = None
 
-def init_db_pool(dsn):
+# Request-path queries go through pools.db_read / pools.db_write, which bound
+# how many connections each side may hold and shed load when they're full;
+# callers see pools.Saturated or TimeoutError rather than an empty result.
+# Hot queries are kept as fixed module-level strings so asyncpg's per-connection
+# statement cache prepares each of them once and reuses the plan.
+# All history queries are range scans on messages_room_ts_id_seq_idx
+# (roomId, timestamp DESC, id DESC) INCLUDE (userId, text, seq); see migrations.py.
+INSERT_MESSAGE_SQL = "INSERT INTO messages (roomId, userId, text) VALUES ($1, $2, $3)"
+INSERT_ROW_SQL = "INSERT INTO messages (roomId, userId, text, timestamp, seq) VALUES ($1, $2, $3, $4, $5)"
+
+FETCH_LATEST_SQL = """
+    SELECT id, userId, text, timestamp, seq
+    FROM messages
+    WHERE roomId = $1
+    ORDER BY timestamp DESC, id DESC
+    LIMIT $2
+"""
+
+FETCH_BEFORE_SQL = """
+    SELECT id, userId, text, timestamp, seq
+    FROM messages
+    WHERE roomId = $1 AND (timestamp, id) < ($2, $3)
+    ORDER BY timestamp DESC, id DESC
+    LIMIT $4
+"""
+
+FETCH_AFTER_SQL = """
+    SELECT id, userId, text, timestamp, seq
+    FROM messages
+    WHERE roomId = $1 AND (timestamp, id) > ($2, $3)
+    ORDER BY timestamp ASC, id ASC
+    LIMIT $4
+"""
+
+# Cursors from before the (timestamp, id) cursor existed were bare ISO timestamps.
+FETCH_BEFORE_TIMESTAMP_SQL = """
+    SELECT id, userId, text, timestamp, seq
+    FROM messages
+    WHERE roomId = $1 AND timestamp < $2
+    ORDER BY timestamp DESC, id DESC
+    LIMIT $3
+"""
+
+# Rows served from the broadcast cache have no id yet; their cursors carry the seq,
+# which orders messages that share a timestamp the same way id does.
+FETCH_BEFORE_SEQ_CURSOR_SQL = """
+    SELECT id, userId, text, timestamp, seq
+    FROM messages
+    WHERE roomId = $1 AND timestamp <= $2 AND (timestamp < $2 OR seq < $3)
+    ORDER BY timestamp DESC, id DESC
+    LIMIT $4
+"""
+
+FETCH_AFTER_SEQ_CURSOR_SQL = """
+    SELECT id, userId, text, timestamp, seq
+    FROM messages
+    WHERE roomId = $1 AND timestamp >= $2 AND (timestamp > $2 OR seq > $3)
+    ORDER BY timestamp ASC, id ASC
+    LIMIT $4
+"""
+
+FETCH_AFTER_SEQ_SQL = """
+    SELECT id, userId, text, timestamp, seq
+    FROM messages
+    WHERE roomId = $1 AND seq > $2
+    ORDER BY seq
+    LIMIT $3
+"""
+
+# Processes reserve seqs in blocks (sequence.py); the row holds the highest
+# number reserved so far.
+RESERVE_SEQS_SQL = "UPDATE room_seqs SET seq = seq + $2 WHERE roomId = $1 RETURNING seq"
+
+# A room's first reservation creates its counter, continuing from the highest stored seq.
+SEED_SEQS_SQL = """
+    INSERT INTO room_seqs (roomId, seq)
+    SELECT $1, coalesce(max(seq), 0) + $2 FROM messages WHERE roomId = $1
+    ON CONFLICT (roomId) DO UPDATE SET seq = room_seqs.seq + $2
+    RETURNING seq
+"""
+
+# Search matches through messages_text_search_idx (GIN on the 'simple' tsvector,
+# which neither stems nor drops stop words, so it suits mixed-language chat).
+# Results are ranked, then keyset-paged on (rank, timestamp, id).
+SEARCH_SQL = """
+    SELECT id, userId, text, timestamp, seq, ts_rank(to_tsvector('simple', text), query) AS rank
+    FROM messages, websearch_to_tsquery('simple', $2) AS query
+    WHERE roomId = $1 AND to_tsvector('simple', text) @@ query
+    ORDER BY rank DESC, timestamp DESC, id DESC
+    LIMIT $3
+"""
+
+SEARCH_AFTER_SQL = """
+    SELECT id, userId, text, timestamp, seq, ts_rank(to_tsvector('simple', text), query) AS rank
+    FROM messages, websearch_to_tsquery('simple', $2) AS query
+    WHERE roomId = $1 AND to_tsvector('simple', text) @@ query
+      AND (ts_rank(to_tsvector('simple', text), query), timestamp, id) < ($4::real, $5, $6)
+    ORDER BY rank DESC, timestamp DESC, id DESC
+    LIMIT $3
+"""
+
+async def init_db_pool(dsn):
     global db_pool
-    db_pool = pool.SimpleConnectionPool(minconn=1, maxconn=10, dsn=dsn)
+    import asyncpg
+    db_pool = await asyncpg.create_pool(
+        dsn=dsn,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+    )
     return db_pool
 
-def test_db_connection():
+async def close_db_pool():
+    global db_pool
+    if db_pool:
+        await db_pool.close()
+        db_pool = None
+
+async def test_db_connection():
     if not db_pool:
         logging.error("FATAL: Database pool is not initialized.")
         return False
-    conn = None
     try:
-        conn = db_pool.getconn()
-        cur = conn.cursor()
-        cur.execute("SELECT VERSION()")
-        version = cur.fetchone()[0]
+        version = await db_pool.fetchval("SELECT VERSION()")
         logging.info(f"Database connection successful! PostgreSQL version: {version}")
-        cur.close()
         return True
     except Exception as e:
         logging.error(f"FATAL: Database connection failed: {e}")
         return False
-    finally:
-        if conn:
-            db_pool.putconn(conn)
 
-def _save_message_to_db_blocking(roomId, userId, text):
-    conn = None
+async def check_db_health(timeout=5):
+    """Round-trip a trivial query through the pool; False if the DB is unreachable."""
+    try:
+        await asyncio.wait_for(db_pool.fetchval("SELECT 1"), timeout)
+        return True
+    except Exception as e:
+        logging.error(f"Database health check failed: {e}")
+        return False
+
+async def db_health_loop():
+    """Periodically ping the DB so dead connections are noticed before a request needs them."""
+    while True:
+        await asyncio.sleep(DB_HEALTH_CHECK_INTERVAL)
+        await check_db_health()
+
+async def save_message_to_db(roomId, userId, text):
+    started = time.perf_counter()
     try:
-        conn = db_pool.getconn()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO messages (roomId, userId, text) VALUES (%s, %s, %s)", (roomId, userId, text))
-        conn.commit()
-        cur.close()
-        logging.info(f"Saved message from '{userId}' in room '{roomId}' to DB.")
+        await pools.db_write.call(db_pool.execute, INSERT_MESSAGE_SQL, roomId, userId, text)
     except Exception as e:
         logging.error(f"Database error: {e}")
-        if conn: conn.rollback()
     finally:
-        if conn:
-            db_pool.putconn(conn)
+        metrics.DB_SAVE_SECONDS.observe(time.perf_counter() - started)
 
-async def save_message_to_db(roomId, userId, text):
-    await asyncio.to_thread(_save_message_to_db_blocking, roomId, userId, text)
+def _row_errors():
+    """Errors that mean a row can't be stored, as opposed to the database being unavailable."""
+    import asyncpg
+    # COPY raises TypeError for a value of the wrong Python type; Postgres raises
+    # DataError for values it can't accept, such as a NUL character in text.
+    return (TypeError, ValueError, asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
 
+async def _insert_rows(rows):
+    """Insert rows one at a time in one transaction, skipping the ones that can't be stored."""
+    saved = 0
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            for row in rows:
+                try:
+                    async with conn.transaction():  # savepoint: a bad row rolls back alone
+                        await conn.execute(INSERT_ROW_SQL, *row)
+                    saved += 1
+                except _row_errors() as e:
+                    logging.error(f"Dropping message for room '{row[0]}' that can't be stored: {e}")
+    return saved
 
-def fetch_messages_keyset(roomId, before=None, limit=50):
-    """Fetch messages with keyset pagination (older messages before a cursor)."""
-    conn = None
-    messages = []
-    nextCursor = None  # bookmark for fetching more
+async def save_messages_batch(rows):
+    """Insert many (roomId, userId, text, timestamp, seq) rows with a single COPY. Returns how many were stored.
 
+    If COPY rejects a row, the batch is inserted row by row so only the bad rows are lost.
+    Any other error (pool saturated, timeout, lost connection) is raised with
+    nothing stored, for the caller to retry.
+    """
+    started = time.perf_counter()
     try:
-        conn = db_pool.getconn()
-        cur = conn.cursor()
-
-        if before:
-            query = """
-                SELECT userId, text, timestamp
-                FROM messages
-                WHERE roomId = %s AND timestamp < %s
-                ORDER BY timestamp DESC
-                LIMIT %s
-            """
-            cur.execute(query, (roomId, before, limit))
-        else:
-            query = """
-                SELECT userId, text, timestamp
-                FROM messages
-                WHERE roomId = %s
-                ORDER BY timestamp DESC
-                LIMIT %s
-            """
-            cur.execute(query, (roomId, limit))
-
-        rows = cur.fetchall()
-        for row in rows:
-            messages.append({
-                "userId": row[0],
-                "text": row[1],
-                "timestamp": row[2].isoformat()
-            })
-
-        # if we got messages, set nextCursor to the last one's timestamp
-        if rows:
-            nextCursor = rows[-1][2].isoformat()
-
-        cur.close()
-    except Exception as e:
-        logging.error(f"Database error while fetching messages: {e}")
+        try:
+            await pools.db_write.call(
+                db_pool.copy_records_to_table,
+                "messages", records=rows, columns=["roomid", "userid", "text", "timestamp", "seq"]
+            )
+            return len(rows)
+        except _row_errors() as e:
+            logging.warning(f"Batch of {len(rows)} messages rejected ({e}); inserting them one at a time")
+        return await pools.db_write.call(_insert_rows, rows)
     finally:
-        if conn:
-            db_pool.putconn(conn)
+        metrics.DB_SAVE_SECONDS.observe(time.perf_counter() - started)
+
+
+def encode_cursor(timestamp, id):
+    """Opaque page cursor for a (timestamp, id) position; timestamp is an ISO string."""
+    return base64.urlsafe_b64encode(f"{timestamp}|{id}".encode()).decode().rstrip("=")
+
+def encode_seq_cursor(timestamp, seq):
+    """Opaque page cursor for a (timestamp, seq) position, for messages not yet stored."""
+    return base64.urlsafe_b64encode(f"{timestamp}|s{seq}".encode()).decode().rstrip("=")
+
+def _unb64_cursor(cursor):
+    if not isinstance(cursor, str):
+        raise ValueError("cursor must be a string")
+    return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+
+def _cursor_timestamp(text):
+    timestamp = datetime.fromisoformat(text)
+    if timestamp.tzinfo is None:
+        raise ValueError("cursor timestamp has no UTC offset")
+    return timestamp
+
+def decode_cursor(cursor):
+    """Return (timestamp, id, seq) for a cursor; raises ValueError if it is malformed.
+
+    At most one of id and seq is set; both are None for a legacy bare-timestamp cursor.
+    """
+    if not isinstance(cursor, str):
+        raise ValueError("cursor must be a string")
+    try:
+        timestamp, position = _unb64_cursor(cursor).split("|")
+    except ValueError:
+        return _cursor_timestamp(cursor), None, None
+    if position.startswith("s"):
+        return _cursor_timestamp(timestamp), None, int(position[1:])
+    return _cursor_timestamp(timestamp), int(position), None
+
+def encode_search_cursor(rank, timestamp, id):
+    """Opaque cursor for the search result after (rank, timestamp, id); timestamp is an ISO string."""
+    return base64.urlsafe_b64encode(f"{rank!r}|{timestamp}|{id}".encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor):
+    """Return (rank, timestamp, id) for a search cursor; raises ValueError if malformed."""
+    rank, timestamp, id = _unb64_cursor(cursor).split("|")
+    return float(rank), _cursor_timestamp(timestamp), int(id)
+
+def search_page(results):
+    """Wrap ranked search results with the cursor for the next page."""
+    last = results[-1] if results else None
+    return {
+        "results": results,
+        "nextCursor": encode_search_cursor(last["rank"], last["timestamp"], last["id"]) if last else None,
+    }
+
+def _message(row):
+    return {
+        "id": row[0],
+        "userId": row[1],
+        "text": row[2],
+        "timestamp": row[3].isoformat(),
+        "seq": row[4]
+    }
+
+def page_from_messages(messages):
+    """Wrap newest-first messages with cursors for older (nextCursor) and newer (prevCursor) pages."""
+    def cursor(message):
+        if message.get("id") is None:
+            # Not persisted yet (served from the broadcast cache): position it by seq.
+            if message.get("seq") is not None:
+                return encode_seq_cursor(message["timestamp"], message["seq"])
+            return message["timestamp"]
+        return encode_cursor(message["timestamp"], message["id"])
 
     return {
         "messages": messages,
-        "nextCursor": nextCursor
-    }
\ No newline at end of file
+        "nextCursor": cursor(messages[-1]) if messages else None,
+        "prevCursor": cursor(messages[0]) if messages else None,
+    }
+
+async def fetch_messages_page(roomId, before=None, limit=50, after=None):
+    """Like fetch_messages_keyset, but lets database errors propagate to the caller.
+
+    Pages that run past the oldest hot partition continue into the archive.
+    """
+    return await pools.db_read.call(_fetch_messages_page, roomId, before, limit, after)
+
+async def _fetch_messages_page(roomId, before, limit, after):
+    started = time.perf_counter()
+    try:
+        if after:
+            timestamp, id, seq = decode_cursor(after)
+            id = id if id is not None else 2**63 - 1
+            rows = []
+            cold = archive.horizon() if archive.enabled() else None
+            if cold is not None and timestamp < cold:
+                rows = await archive.fetch_newer(roomId, timestamp, id, limit)
+                if rows:
+                    timestamp, id, seq = rows[-1][3], rows[-1][0], None
+            if len(rows) < limit:
+                if seq is not None:
+                    rows += await db_pool.fetch(FETCH_AFTER_SEQ_CURSOR_SQL, roomId, timestamp, seq, limit - len(rows))
+                else:
+                    rows += await db_pool.fetch(FETCH_AFTER_SQL, roomId, timestamp, id, limit - len(rows))
+            rows = rows[::-1]
+        else:
+            if before:
+                timestamp, id, seq = decode_cursor(before)
+                if seq is not None:
+                    rows = await db_pool.fetch(FETCH_BEFORE_SEQ_CURSOR_SQL, roomId, timestamp, seq, limit)
+                    id = -1
+                elif id is None:
+                    rows = await db_pool.fetch(FETCH_BEFORE_TIMESTAMP_SQL, roomId, timestamp, limit)
+                    id = -1
+                else:
+                    rows = await db_pool.fetch(FETCH_BEFORE_SQL, roomId, timestamp, id, limit)
+            else:
+                timestamp, id = None, None
+                rows = await db_pool.fetch(FETCH_LATEST_SQL, roomId, limit)
+            if len(rows) < limit and archive.enabled():
+                if rows:
+                    timestamp, id = rows[-1]["timestamp"], rows[-1]["id"]
+                rows = list(rows) + await archive.fetch_older(roomId, timestamp, id, limit - len(rows))
+    finally:
+        metrics.DB_FETCH_SECONDS.observe(time.perf_counter() - started)
+
+    return page_from_messages([_message(row) for row in rows])
+
+async def reserve_seqs(roomId, count):
+    """Reserve `count` consecutive sequence numbers for a room and return the first.
+
+    The counter is a row in room_seqs, so every worker and node (and a successor
+    during a handoff) reserves from the same sequence. Errors propagate; the
+    caller retries in the background, off the message path, so this doesn't go
+    through pools.db_write.
+    """
+    started = time.perf_counter()
+    try:
+        last = await db_pool.fetchval(RESERVE_SEQS_SQL, roomId, count)
+        if last is None:
+            last = await db_pool.fetchval(SEED_SEQS_SQL, roomId, count)
+        return last - count + 1
+    finally:
+        metrics.SEQ_RESERVE_SECONDS.observe(time.perf_counter() - started)
+
+async def fetch_messages_after_seq(roomId, after, limit):
+    """Up to `limit` persisted messages with seq > after, oldest first."""
+    started = time.perf_counter()
+    try:
+        rows = await pools.db_read.call(db_pool.fetch, FETCH_AFTER_SEQ_SQL, roomId, after, limit)
+    except (pools.Saturated, TimeoutError):
+        raise
+    except Exception as e:
+        logging.error(f"Database error while fetching messages after seq {after}: {e}")
+        return []
+    finally:
+        metrics.DB_FETCH_SECONDS.observe(time.perf_counter() - started)
+    return [_message(row) for row in rows]
+
+async def search_messages(roomId, query, limit=20, cursor=None):
+    """Rank a room's messages against a web-search style query (quoted phrases, OR, -word).
+
+    Returns {"results": [message + "rank"], "nextCursor"}; pass nextCursor back
+    as `cursor` for the next page. Only hot partitions are searched, not the archive.
+    """
+    started = time.perf_counter()
+    try:
+        if cursor:
+            rank, timestamp, id = decode_search_cursor(cursor)
+            rows = await pools.db_read.call(db_pool.fetch, SEARCH_AFTER_SQL, roomId, query, limit, rank, timestamp, id)
+        else:
+            rows = await pools.db_read.call(db_pool.fetch, SEARCH_SQL, roomId, query, limit)
+    except (pools.Saturated, TimeoutError):
+        raise
+    except ValueError:
+        logging.warning(f"Ignoring malformed search cursor for room {roomId}")
+        return search_page([])
+    except Exception as e:
+        logging.error(f"Database error while searching messages: {e}")
+        return search_page([])
+    finally:
+        metrics.DB_FETCH_SECONDS.observe(time.perf_counter() - started)
+    return search_page([{**_message(row), "rank": row["rank"]} for row in rows])
+
+async def fetch_messages_keyset(roomId, before=None, limit=50, after=None):
+    """Fetch a page of messages, newest first, older than `before` or newer than `after`.
+
+    Cursors are the opaque nextCursor/prevCursor values of a previous page; a
+    malformed one gets an empty page.
+    """
+    try:
+        for cursor in (before, after):
+            if cursor:
+                decode_cursor(cursor)
+    except ValueError:
+        logging.warning(f"Ignoring malformed history cursor for room {roomId}")
+        return page_from_messages([])
+    try:
+        return await fetch_messages_page(roomId, before, limit, after)
+    except (pools.Saturated, TimeoutError):
+        raise
+    except Exception as e:
+        logging.error(f"Database error while fetching messages: {e}")
+        return {
+            "messages": [],
+            "nextCursor": None,
+            "prevCursor": None
+        }
@@ -0,0 +1,39 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, UTC
+from . import registry
+from . import resume
+from .fanout import send_payload
+
+# Graceful drain: once the server has stopped accepting, existing clients are
+# told to reconnect and closed at random points across DRAIN_SECONDS, so they
+# don't all reconnect, re-authenticate and reload history in the same instant.
+
+FLUSH_TIMEOUT = 5  # seconds a client gets to take its queued frames before the close
+
+stats = {"draining": 0, "closed": 0, "tokens_issued": 0}
+
+async def _close_later(session, delay):
+    await asyncio.sleep(delay)
+    notice = {"type": "reconnect", "reason": "server_restart"}
+    if resume.enabled() and session.user_id is not None and session.room_id is not None:
+        # Everything broadcast before now is already queued ahead of this notice.
+        since = datetime.now(UTC).isoformat()
+        notice["resumeToken"] = resume.issue(session.user_id, session.room_id, since)
+        stats["tokens_issued"] += 1
+    if session.outbox is not None:
+        send_payload(session, notice)
+        await session.outbox.finish(FLUSH_TIMEOUT)
+    await session.websocket.close(1001, "Server restarting")
+    stats["closed"] += 1
+
+async def drain_sessions(window):
+    """Close every open session with a reconnect notice, spread over `window` seconds."""
+    sessions = registry.all_sessions()
+    stats["draining"] = len(sessions)
+    logging.info(f"Draining {len(sessions)} connections over {window}s")
+    await asyncio.gather(
+        *(_close_later(session, random.uniform(0, window)) for session in sessions),
+        return_exceptions=True,
+    )
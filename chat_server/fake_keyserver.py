@@ -0,0 +1,100 @@
+"""Local stand-in for Google's Firebase signing-cert endpoint, for tests and benchmarks.
+
+    server = FakeKeyServer(project_id="demo-project").start()
+    os.environ["FIREBASE_CERTS_URL"] = server.url
+    token = server.mint_token("alice")
+"""
+import datetime
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+def _generate_key_pair():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-securetoken")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM).decode()
+    return key_pem, cert_pem
+
+class FakeKeyServer:
+    """Serves {kid: cert_pem} with a Cache-Control max-age, like the real endpoint."""
+
+    def __init__(self, project_id, host="127.0.0.1", port=0, max_age=3600):
+        self.project_id = project_id
+        self.max_age = max_age
+        self.requests = 0
+        self.keys = {}
+        self.rotate()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.url = f"http://{host}:{self._httpd.server_address[1]}/"
+
+    def rotate(self):
+        """Add a fresh signing key and make it the one used by mint_token."""
+        self.kid = uuid.uuid4().hex
+        self.keys[self.kid] = _generate_key_pair()
+        return self.kid
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                body = json.dumps({kid: cert for kid, (_, cert) in server.keys.items()}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", f"public, max-age={server.max_age}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def mint_token(self, user_id, lifetime=3600, **claims):
+        """Return a Firebase-shaped ID token for user_id signed with the current key."""
+        now = int(time.time())
+        payload = {
+            "iss": f"https://securetoken.google.com/{self.project_id}",
+            "aud": self.project_id,
+            "sub": user_id,
+            "user_id": user_id,
+            "iat": now,
+            "exp": now + lifetime,
+            "auth_time": now,
+            **claims,
+        }
+        signer = crypt.RSASigner.from_string(self.keys[self.kid][0], self.kid)
+        return jwt.encode(signer, payload).decode()
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from collections import deque
+import websockets
+from websockets.protocol import State
+from .config import OUTBOX_MAX_FRAMES, OUTBOX_OVERFLOW_POLICY, WS_COMPRESSION_MIN_SIZE
+from .codec import OP_TEXT
+from . import compression
+from . import metrics
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+if OUTBOX_OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(f"OUTBOX_OVERFLOW_POLICY must be one of {OVERFLOW_POLICIES}")
+
+# Sent in place of the frames a slow client missed under the "coalesce" policy;
+# the client is expected to re-sync with load_chat.
+RESYNC_PAYLOAD = {"type": "resync", "reason": "slow_consumer"}
+
+stats = {"dropped": 0, "coalesced": 0, "disconnected": 0}
+
+class Outbox:
+    """Bounded per-connection send queue drained by its own writer task.
+
+    Frames are (opcode, payload) pairs, or complete wire frames (bytes) shared
+    by every recipient of a compressed broadcast.
+    """
+    __slots__ = ("session", "frames", "ready", "task", "closed", "deflate", "shared_key")
+
+    def __init__(self, session):
+        self.session = session
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.deflate, self.shared_key = compression.negotiated(session.websocket)
+        self.task = asyncio.create_task(self._drain())
+
+    def push(self, frame):
+        if self.closed:
+            return
+        if len(self.frames) >= OUTBOX_MAX_FRAMES:
+            if OUTBOX_OVERFLOW_POLICY == "drop_oldest":
+                self.frames.popleft()
+                stats["dropped"] += 1
+            elif OUTBOX_OVERFLOW_POLICY == "coalesce":
+                stats["coalesced"] += len(self.frames)
+                self.frames.clear()
+                self.frames.append(self.session.codec.encode(RESYNC_PAYLOAD))
+            else:
+                self._disconnect()
+                return
+        self.frames.append(frame)
+        self.ready.set()
+
+    def _disconnect(self):
+        self.closed = True
+        self.frames.clear()
+        stats["disconnected"] += 1
+        logging.warning("Disconnecting slow consumer '%s'", self.session.user_id,
+                        extra={"event": "outbox.slow_consumer", "userId": self.session.user_id})
+        asyncio.create_task(self.session.websocket.close(1013, "Slow consumer"))
+
+    async def _drain(self):
+        websocket = self.session.websocket
+        # The legacy protocol's write_frame takes pre-encoded payload bytes,
+        # which skips the per-recipient str -> bytes encode done by send().
+        write_frame = getattr(websocket, "write_frame", None)
+        try:
+            while True:
+                if not self.frames:
+                    if self.closed:
+                        break
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                frame = self.frames.popleft()
+                if write_frame is None:
+                    opcode, data = frame
+                    await websocket.send(data.decode("utf-8") if opcode == OP_TEXT else data)
+                    continue
+                if frame.__class__ is not bytes:
+                    opcode, data = frame
+                    if not (self.deflate and len(data) < WS_COMPRESSION_MIN_SIZE):
+                        await write_frame(True, opcode, data)
+                        continue
+                    # Too small to be worth deflating: send it as an uncompressed message.
+                    compression.stats["uncompressed_small"] += 1
+                    frame = compression.wire_frame(opcode, data)
+                if websocket.state is not State.OPEN:
+                    await websocket.ensure_open()
+                websocket.transport.write(frame)
+                await websocket.drain()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self.frames.clear()
+
+    async def finish(self, timeout):
+        """Refuse new frames and wait up to `timeout` seconds for queued ones to be written."""
+        self.closed = True
+        self.ready.set()
+        await asyncio.wait([self.task], timeout=timeout)
+
+    def close(self):
+        self.closed = True
+        self.task.cancel()
+
+def attach_outbox(session):
+    outbox = session.outbox
+    if outbox is None:
+        outbox = session.outbox = Outbox(session)
+    return outbox
+
+def detach_outbox(session):
+    outbox = session.outbox
+    if outbox is not None:
+        outbox.close()
+        session.outbox = None
+
+def send_payload(session, payload):
+    """Queue a payload for one connection, encoded with that connection's codec."""
+    attach_outbox(session).push(session.codec.encode(payload))
+    metrics.MESSAGES_OUT.inc()
+
+def fan_out(sessions, payload, exclude=None):
+    """Queue a payload on every session's outbox; never awaits a socket.
+
+    The payload is encoded once per codec in use, and every client sharing
+    a codec gets the same frame bytes. Clients with a shareable deflate
+    context also share one compressed wire frame per window size.
+    """
+    frames = {}
+    wire_frames = {}
+    sent = 0
+    for session in sessions:
+        if session is exclude:
+            continue
+        codec = session.codec
+        frame = frames.get(codec.name)
+        if frame is None:
+            frame = frames[codec.name] = codec.encode(payload)
+        outbox = attach_outbox(session)
+        shared_key = outbox.shared_key
+        if shared_key is not None and len(frame[1]) >= WS_COMPRESSION_MIN_SIZE:
+            key = (codec.name, shared_key)
+            wire = wire_frames.get(key)
+            if wire is None:
+                wire = wire_frames[key] = compression.compressed_frame(frame[0], frame[1], shared_key)
+            compression.stats["shared_recipients"] += 1
+            outbox.push(wire)
+        else:
+            outbox.push(frame)
+        sent += 1
+    metrics.MESSAGES_OUT.inc(sent)
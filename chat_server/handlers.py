@@ -1,75 +1,240 @@
-import json
 import logging
+import math
+import time
 from datetime import datetime, UTC
 import websockets
-from auth import verify_firebase_token
-from rooms import register, unregister, broadcast
-from db import save_message_to_db, fetch_messages_keyset
+from .auth import verify_firebase_token
+from .rooms import register, unregister, broadcast, deliver_local
+from .history import load_history, record_message, replay, sync_after
+from .writer import enqueue_message
+from .fanout import attach_outbox, detach_outbox, send_payload
+from .codec import codec_for
+from .config import (
+    MESSAGE_MAX_CHARS, RESUME_MAX_MESSAGES, JOIN_TIMEOUT, SYNC_MAX_MESSAGES, SEARCH_MAX_QUERY_CHARS, SEARCH_MAX_RESULTS,
+)
+from . import admission
+from . import db
+from . import pools
+from . import registry
+from . import ratelimit
+from . import resume
+from . import sequence
+from . import presence
+from . import profiling
+from . import metrics
 import asyncio
 
 async def chat_handler(websocket):
+    session = registry.open_session(websocket, codec_for(websocket.subprotocol))
+    session.limits = ratelimit.ConnectionLimits()
+    metrics.CONNECTIONS_TOTAL.inc()
     try:
-        join_message = await websocket.recv()
-        data = json.loads(join_message)
-
-        if data.get("type") != "join":
-            await websocket.close(1008, "First message must be join.")
-            return
-
-        token, roomId = data.get("token"), data.get("roomId")
-        if not token or not roomId:
-            await websocket.close(1008, "Token & roomId required.")
-            return
-
-        decoded_token = await verify_firebase_token(token)
-        if not decoded_token:
-            await websocket.close(4001, "Invalid authentication token.")
-            return
+        # Set by admission.ChatServerProtocol when the upgrade carried credentials.
+        identity = getattr(websocket, "identity", None)
+        if identity is not None and identity[1] is not None:
+            userId, roomId, since = identity
+        else:
+            userId, roomId, since = await _await_join(websocket, session, identity)
+            if userId is None:
+                return
 
-        trusted_userId = decoded_token['user_id']
-        await register(websocket, roomId, trusted_userId)
+        registry.set_user(session, userId)
+        attach_outbox(session)
+        await register(session, roomId)
+        if since is not None:
+            # Messages from here on arrive live; replay only the gap before.
+            until = datetime.now(UTC).isoformat()
+            try:
+                missed = await replay(roomId, since, until, RESUME_MAX_MESSAGES)
+                send_payload(session, {"type": "resumed", "roomId": roomId, "messages": missed})
+            except (pools.Saturated, TimeoutError):
+                _overloaded(session, "resume")
 
         async for message in websocket:
-            await handle_message(websocket, message)
+            await handle_message(session, message)
 
     except websockets.exceptions.ConnectionClosed as e:
-        logging.info(f"Connection closed: {e.code} {e.reason}")
+        logging.info("Connection closed: %s %s", e.code, e.reason,
+                     extra={"event": "connection.close", "code": e.code, "userId": session.user_id})
     finally:
-        await unregister(websocket)
+        await unregister(session)
+        detach_outbox(session)
+        userId = session.user_id
+        registry.close_session(session)
+        if userId is not None and not registry.is_online(userId):
+            ratelimit.forget_user(userId)
+
+
+_NO_JOIN = (None, None, None)
+
+def _is_text(value):
+    """A str every codec can encode. stdlib json decodes "\ud800" to a lone
+    surrogate, which msgpack and orjson refuse, so it would break fan-out."""
+    if not isinstance(value, str):
+        return False
+    if value.isascii():
+        return True
+    try:
+        value.encode()
+    except UnicodeEncodeError:
+        return False
+    return True
 
+async def _await_join(websocket, session, identity):
+    """Read the join (or resume) frame. Returns (userId, roomId, since); userId None if the socket was closed.
 
-async def handle_message(websocket, raw_message):
+    `identity` is (userId, None, None) when the upgrade was already authenticated
+    but named no room; the frame then only has to name one.
+    """
+    try:
+        join_message = await asyncio.wait_for(websocket.recv(), JOIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        admission.stats["join_timeouts"] += 1
+        await websocket.close(1008, "Join timeout.")
+        return _NO_JOIN
+    try:
+        data = session.codec.decode(join_message)
+    except ValueError:
+        await websocket.close(1008, "Invalid join frame.")
+        return _NO_JOIN
+
+    if isinstance(data, dict) and data.get("type") == "resume":
+        # Reconnect after a drain: the signed token stands in for Firebase verification.
+        resumed = resume.verify(data.get("resumeToken"))
+        if not resumed:
+            await websocket.close(4001, "Invalid resume token.")
+            return _NO_JOIN
+        return resumed
+
+    if not isinstance(data, dict) or data.get("type") != "join":
+        await websocket.close(1008, "First message must be join.")
+        return _NO_JOIN
+
+    token, roomId = data.get("token"), data.get("roomId")
+    if not (token or identity) or not roomId or not _is_text(roomId):
+        await websocket.close(1008, "Token & roomId required.")
+        return _NO_JOIN
+    if identity is not None:
+        return identity[0], roomId, None
+
+    try:
+        decoded_token = await verify_firebase_token(token)
+    except (pools.Saturated, TimeoutError):
+        # 1013 "Try Again Later": the client should back off, not re-auth.
+        await websocket.close(1013, "Server busy, try again later.")
+        return _NO_JOIN
+    if not decoded_token:
+        await websocket.close(4001, "Invalid authentication token.")
+        return _NO_JOIN
+    return decoded_token['user_id'], roomId, None
+
+async def _throttle(session, action, scope, now, wait):
+    """Tell the client it was throttled, or close it if it keeps flooding."""
+    notify, disconnect = ratelimit.throttled(session.limits, now, wait)
+    if disconnect:
+        logging.warning("Disconnecting '%s': rate limit exceeded", session.user_id,
+                        extra={"event": "ratelimit.disconnect", "userId": session.user_id})
+        await session.websocket.close(1008, "Rate limit exceeded.")
+    elif notify:
+        send_payload(session, {
+            "type": "throttled",
+            "action": action,
+            "scope": scope,
+            "retryAfterMs": math.ceil(wait * 1000)
+        })
+
+async def handle_message(session, raw_message):
+    metrics.MESSAGES_IN.inc()
+    clock = time.monotonic()
+    wait = ratelimit.check_frame(session.limits, clock)
+    if wait:
+        await _throttle(session, "frame", "connection", clock, wait)
+        return
     try:
-        data = json.loads(raw_message)
-    except json.JSONDecodeError:
-        logging.warning("Invalid JSON")
+        data = session.codec.decode(raw_message)
+    except ValueError:
+        logging.warning("Invalid %s frame", session.codec.name,
+                        extra={"event": "frame.invalid", "userId": session.user_id})
+        return
+    if not isinstance(data, dict):
+        logging.warning("Frame is not an object", extra={"event": "frame.invalid", "userId": session.user_id})
+        return
+
+    kind = data.get("type")
+    if kind == "message":
+        text = data.get("text")
+        if not _is_text(text) or "\x00" in text:
+            # Postgres can't store NUL characters in text.
+            send_payload(session, {"type": "error", "reason": "invalid_message",
+                                   "detail": "text must be valid Unicode without NUL characters"})
+            return
+        if len(text) > MESSAGE_MAX_CHARS:
+            ratelimit.stats["rejected_oversize"] += 1
+            send_payload(session, {"type": "error", "reason": "text_too_long", "maxChars": MESSAGE_MAX_CHARS})
+            return
+    scope, wait = ratelimit.check_action(session, kind, clock)
+    if wait:
+        await _throttle(session, kind, scope, clock, wait)
         return
 
-    if data.get("type") == "message":
+    started = time.perf_counter()
+    try:
+        await _dispatch(session, kind, data)
+    except (pools.Saturated, TimeoutError):
+        _overloaded(session, kind)
+    if profiling.active:
+        profiling.observe(kind, time.perf_counter() - started)
+
+def _overloaded(session, action):
+    """Tell the client a request was shed because a worker pool is full or too slow."""
+    send_payload(session, {"type": "error", "reason": "overloaded", "action": action})
+
+async def _dispatch(session, kind, data):
+    if kind == "message":
+        text = data.get("text")
+        # None only if no block of seqs could be reserved; the message still goes out.
+        seq = sequence.next_seq(session.room_id)
+        now = datetime.now(UTC)
         payload = {
             "type": "message",
-            "text": data.get("text"),
-            "userId": websocket.user_id,
-            "roomId": websocket.room_id,
-            "timestamp": datetime.now(UTC).isoformat()
+            "text": text,
+            "userId": session.user_id,
+            "roomId": session.room_id,
+            "timestamp": now.isoformat(),
+            "seq": seq
         }
-        await broadcast(websocket.room_id, json.dumps(payload), exclude_sender=True, sender_websocket=websocket)
-        await save_message_to_db(websocket.room_id, websocket.user_id, data.get("text"))
+        await broadcast(session.room_id, payload, exclude_sender=True, sender=session)
+        # The sender isn't sent its own message, so this is how it learns the seq.
+        send_payload(session, {"type": "ack", "seq": seq, "timestamp": payload["timestamp"]})
+        record_message(session.room_id, {
+            "userId": payload["userId"],
+            "text": payload["text"],
+            "timestamp": payload["timestamp"],
+            "seq": seq
+        })
+        await enqueue_message(session.room_id, session.user_id, text, now, seq)
 
-    elif data.get("type") == "join":
+    elif kind == "join":
         new_roomId = data.get("roomId")
-        current_userId = websocket.user_id
+        current_userId = session.user_id
                 
-        if new_roomId and new_roomId != websocket.room_id:
-            logging.info(f"User '{current_userId}' is switching to room '{new_roomId}'.")
-            await unregister(websocket)
-            await register(websocket, new_roomId, current_userId)
+        if new_roomId and _is_text(new_roomId) and new_roomId != session.room_id:
+            logging.info("User '%s' is switching to room '%s'.", current_userId, new_roomId,
+                         extra={"event": "room.switch", "userId": current_userId, "roomId": new_roomId})
+            await unregister(session)
+            await register(session, new_roomId)
         else:
-            logging.warning(f"User '{current_userId}' sent an invalid room-switch request.")
+            logging.warning("User '%s' sent an invalid room-switch request.", current_userId,
+                            extra={"event": "room.switch_invalid", "userId": current_userId})
 
 
-    elif data.get("type") == "load_chat":
-        before = data.get("before")  # ISO timestamp string
+    elif kind == "load_chat":
+        before = data.get("before")  # nextCursor of a previous page: older messages
+        after = data.get("after")  # prevCursor of a previous page: newer messages
+        if not all(cursor is None or isinstance(cursor, str) for cursor in (before, after)):
+            send_payload(session, {"type": "error", "reason": "invalid_cursor",
+                                   "detail": "before and after must be cursors from a previous page"})
+            return
         limit = data.get("limit", 50)
         try:
             limit = int(limit)
@@ -78,13 +243,78 @@ async def handle_message(websocket, raw_message):
         except (ValueError, TypeError):
             limit = 50
 
-        messages = fetch_messages_keyset(websocket.room_id, before, limit)
+        messages = await load_history(session.room_id, before, limit, after)
         response = {
             "type": "chat_history",
             "messages": messages
         }
-        await websocket.send(json.dumps(response))
+        send_payload(session, response)
         
 
+    elif kind == "sync":
+        # "Everything after seq N": costs as much as the gap, not a history page.
+        after = data.get("after")
+        if not isinstance(after, int) or isinstance(after, bool) or after < 0:
+            send_payload(session, {"type": "error", "reason": "invalid_sync", "detail": "after must be a seq >= 0"})
+            return
+        messages, complete = await sync_after(session.room_id, after, SYNC_MAX_MESSAGES)
+        send_payload(session, {
+            "type": "sync",
+            "roomId": session.room_id,
+            "after": after,
+            "messages": messages,
+            "complete": complete
+        })
+
+    elif kind == "search":
+        query = data.get("query")
+        room_id = data.get("roomId") or session.room_id  # any room can be joined, so any room can be searched
+        if not isinstance(query, str) or not query.strip() or len(query) > SEARCH_MAX_QUERY_CHARS \
+                or not isinstance(room_id, str):
+            send_payload(session, {"type": "error", "reason": "invalid_search",
+                                   "detail": f"query must be 1-{SEARCH_MAX_QUERY_CHARS} characters"})
+            return
+        limit = data.get("limit", 20)
+        try:
+            limit = int(limit)
+            if limit <= 0 or limit > SEARCH_MAX_RESULTS:
+                limit = 20
+        except (ValueError, TypeError):
+            limit = 20
+
+        cursor = data.get("cursor")
+        if cursor is not None and not isinstance(cursor, str):
+            send_payload(session, {"type": "error", "reason": "invalid_cursor",
+                                   "detail": "cursor must be the nextCursor of a previous page"})
+            return
+        page = await db.search_messages(room_id, query, limit, cursor)
+        send_payload(session, {
+            "type": "search_results",
+            "roomId": room_id,
+            "query": query,
+            **page
+        })
+
+    elif kind == "presence":
+        after = data.get("after")
+        if after is not None and not isinstance(after, str):
+            send_payload(session, {"type": "error", "reason": "invalid_presence", "detail": "after must be a userId"})
+            return
+        send_payload(session, presence.snapshot(session.room_id, after))
+
     else:
-        logging.warning(f"Unknown message type: {data.get('type')}")
+        logging.warning("Unknown message type: %s", kind,
+                        extra={"event": "frame.unknown_type", "userId": session.user_id})
+
+
+def deliver_remote(roomId, message):
+    """Deliver a broadcast relayed from another worker to this worker's members."""
+    deliver_local(roomId, message)
+    if message.get("type") == "message":
+        sequence.observe(roomId, message.get("seq"))
+        record_message(roomId, {
+            "userId": message["userId"],
+            "text": message["text"],
+            "timestamp": message["timestamp"],
+            "seq": message.get("seq")
+        })
@@ -0,0 +1,252 @@
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime
+from .config import HISTORY_CACHE_SIZE, HISTORY_CACHE_BUDGET_BYTES
+from .db import decode_cursor, fetch_messages_keyset, fetch_messages_page, fetch_messages_after_seq, page_from_messages
+
+# Rough per-entry overhead (dict + deque slot + str headers) used for the memory budget.
+_ENTRY_OVERHEAD = 300
+
+class _RoomHistory:
+    __slots__ = ("messages", "sizes", "complete", "size")
+
+    def __init__(self, messages, complete):
+        # Oldest on the left, newest on the right.
+        self.messages = deque(maxlen=HISTORY_CACHE_SIZE)
+        # Each entry's size, computed once on the way in so eviction can't fail on it.
+        self.sizes = deque(maxlen=HISTORY_CACHE_SIZE)
+        self.complete = complete  # True when the room has no history beyond what is cached
+        self.size = 0
+        for message in messages:
+            self.append(message)
+
+    def append(self, message):
+        size = _message_size(message)
+        if len(self.messages) == self.messages.maxlen:
+            self.size -= self.sizes[0]
+            self.complete = False
+        self.messages.append(message)
+        self.sizes.append(size)
+        self.size += size
+
+# roomId -> _RoomHistory, least recently used first
+_rooms = OrderedDict()
+_total_size = 0
+_warming = {}
+
+stats = {
+    "hits": 0, "misses": 0, "evictions": 0,
+    "replay_hits": 0, "replay_misses": 0, "sync_hits": 0, "sync_misses": 0,
+}
+
+def _message_size(message):
+    return _ENTRY_OVERHEAD + len(message["text"] or "") + len(message["userId"]) + len(message["timestamp"])
+
+def _evict():
+    global _total_size
+    while _total_size > HISTORY_CACHE_BUDGET_BYTES and _rooms:
+        _, entry = _rooms.popitem(last=False)
+        _total_size -= entry.size
+        stats["evictions"] += 1
+
+def is_cached(roomId):
+    return roomId in _rooms
+
+def record_message(roomId, message):
+    """Append a broadcast message to the room's recent-history buffer.
+
+    Rooms that aren't warm get a partial buffer holding everything broadcast
+    from now on, which is what sync replays from.
+    """
+    global _total_size
+    entry = _rooms.get(roomId)
+    if entry is None:
+        entry = _rooms[roomId] = _RoomHistory((), complete=False)
+    before = entry.size
+    entry.append(message)
+    _total_size += entry.size - before
+    _rooms.move_to_end(roomId)
+    _evict()
+
+def _warm(roomId, newest_first, complete):
+    global _total_size
+    old = _rooms.pop(roomId, None)
+    messages = list(reversed(newest_first))
+    if old:
+        _total_size -= old.size
+        # Keep buffered messages the write-behind queue hasn't persisted yet.
+        newest = max((m["seq"] or 0 for m in messages), default=0)
+        messages += [m for m in old.messages if (m.get("seq") or 0) > newest]
+    entry = _RoomHistory(messages, complete)
+    _rooms[roomId] = entry
+    _total_size += entry.size
+    _evict()
+    return entry
+
+def _page(entry, limit):
+    messages = list(entry.messages)[-limit:]
+    messages.reverse()
+    return page_from_messages(messages)
+
+async def _load_room(roomId):
+    task = asyncio.current_task()
+    try:
+        result = await fetch_messages_page(roomId, None, HISTORY_CACHE_SIZE)
+        messages = result["messages"]
+        complete = len(messages) < HISTORY_CACHE_SIZE
+        if _warming.get(roomId) is not task:
+            # Forgotten while loading: answer this request, but don't cache it.
+            return _RoomHistory(reversed(messages), complete)
+        return _warm(roomId, messages, complete)
+    finally:
+        if _warming.get(roomId) is task:
+            del _warming[roomId]
+
+def forget_room(roomId):
+    """Drop a room's buffer once it stops receiving the room's broadcasts.
+
+    A node unsubscribes from a room's broker channel when its last local member
+    leaves; messages sent on other nodes after that would be missing from the
+    buffer, which would then serve pages and syncs with holes in them.
+    """
+    global _total_size
+    _warming.pop(roomId, None)
+    entry = _rooms.pop(roomId, None)
+    if entry is not None:
+        _total_size -= entry.size
+
+def _position(message):
+    return datetime.fromisoformat(message["timestamp"]), message.get("id"), message.get("seq")
+
+def _compare(message, position):
+    """Negative, zero or positive as a buffered message sorts before, at or after a cursor position.
+
+    Positions are decode_cursor results. They order by timestamp, then by seq
+    or id where both sides have one; any other tie is the cursor's own message.
+    """
+    timestamp, id, seq = position
+    at = datetime.fromisoformat(message["timestamp"])
+    if at != timestamp:
+        return -1 if at < timestamp else 1
+    for mine, theirs in ((message.get("seq"), seq), (message.get("id"), id)):
+        if mine is not None and theirs is not None and mine != theirs:
+            return -1 if mine < theirs else 1
+    return 0
+
+def _cursor(message):
+    return page_from_messages([message])["nextCursor"]
+
+# Messages still in the write-behind queue are only in the buffer, so the part
+# of a page the buffer covers is served from it; the database only supplies
+# what lies beyond the oldest buffered message.
+
+async def _older(roomId, entry, before, limit):
+    """Up to `limit` messages older than the `before` cursor (None: all), newest first."""
+    position = decode_cursor(before) if before else None
+    messages = [m for m in entry.messages if position is None or _compare(m, position) < 0]
+    messages.reverse()
+    if len(messages) < limit and not entry.complete:
+        if messages:
+            before = _cursor(entry.messages[0])
+        page = await fetch_messages_keyset(roomId, before, limit - len(messages))
+        messages += page["messages"]
+    return messages[:limit]
+
+def _reaches(entry, position):
+    """Whether the buffer holds every message after `position`."""
+    return entry.complete or bool(entry.messages) and _compare(entry.messages[0], position) <= 0
+
+async def _newer(roomId, entry, after, limit):
+    """Up to `limit` messages just newer than the `after` cursor, oldest first."""
+    position = decode_cursor(after)
+    messages = [m for m in entry.messages if _compare(m, position) > 0]
+    if not _reaches(entry, position):
+        page = await fetch_messages_keyset(roomId, None, limit, after)
+        stored = reversed(page["messages"])
+        if entry.messages:
+            oldest = _position(entry.messages[0])
+            stored = [m for m in stored if _compare(m, oldest) < 0]
+        messages = list(stored) + messages
+    return messages[:limit]
+
+async def load_history(roomId, before=None, limit=50, after=None):
+    """Serve a load_chat page, answering from memory as far as the room's buffer reaches."""
+    entry = _rooms.get(roomId)
+    if before or after or limit > HISTORY_CACHE_SIZE:
+        if entry is None:
+            return await fetch_messages_keyset(roomId, before, limit, after)
+        _rooms.move_to_end(roomId)
+        try:
+            if after:
+                messages = await _newer(roomId, entry, after, limit)
+                messages.reverse()
+            else:
+                messages = await _older(roomId, entry, before, limit)
+        except ValueError:
+            # A malformed cursor; the database path answers those with an empty page too.
+            messages = []
+        return page_from_messages(messages)
+
+    if entry is not None and (len(entry.messages) >= limit or entry.complete):
+        stats["hits"] += 1
+        _rooms.move_to_end(roomId)
+        return _page(entry, limit)
+
+    stats["misses"] += 1
+    # Concurrent misses for the same room share one DB query.
+    task = _warming.get(roomId)
+    if task is None:
+        task = _warming[roomId] = asyncio.ensure_future(_load_room(roomId))
+    try:
+        entry = await asyncio.shield(task)
+    except Exception:
+        # Don't cache a failed load; fall back to the error-tolerant path.
+        return await fetch_messages_keyset(roomId, None, limit)
+    return _page(entry, limit)
+
+async def replay(roomId, since, until, limit):
+    """Page of messages a resumed client missed: newer than `since`, no newer than `until`.
+
+    Both bounds are ISO timestamps. Served from the recent-history buffer as far
+    as it reaches back, the rest from the database. The page holds the oldest
+    missed messages; prevCursor continues forward from there.
+    """
+    until_at = datetime.fromisoformat(until)
+    entry = _rooms.get(roomId)
+    if entry is None:
+        stats["replay_misses"] += 1
+        page = await fetch_messages_keyset(roomId, None, limit, since)
+        messages = list(reversed(page["messages"]))
+    else:
+        # A bare timestamp is a valid (legacy) cursor.
+        stats["replay_hits" if _reaches(entry, decode_cursor(since)) else "replay_misses"] += 1
+        messages = await _newer(roomId, entry, since, limit)
+    messages = [message for message in messages if datetime.fromisoformat(message["timestamp"]) <= until_at]
+    messages.reverse()
+    return page_from_messages(messages)
+
+async def sync_after(roomId, after, limit):
+    """Messages with seq > after, oldest first, and whether that reaches the newest message.
+
+    Answered from the recent-history buffer when it reaches back to `after`;
+    otherwise the database supplies the older part of the gap.
+    """
+    entry = _rooms.get(roomId)
+    buffered = list(entry.messages) if entry is not None else []
+    # Workers allocate from a shared counter, so relayed messages can arrive
+    # slightly out of seq order; the buffer covers everything from its lowest seq.
+    first = min((m["seq"] for m in buffered if m.get("seq") is not None), default=None)
+    if buffered and (entry.complete or (first is not None and first <= after + 1)):
+        stats["sync_hits"] += 1
+        missed = [m for m in buffered if (m.get("seq") or 0) > after]
+    else:
+        stats["sync_misses"] += 1
+        missed = await fetch_messages_after_seq(roomId, after, limit + 1)
+        if first is not None:
+            # Rows still in the write-behind queue are only in the buffer.
+            missed = [m for m in missed if m["seq"] < first] + [m for m in buffered if (m.get("seq") or 0) > after]
+    missed.sort(key=lambda m: m.get("seq") or 0)
+    return missed[:limit], len(missed) <= limit
+
+def get_history_stats():
+    return {**stats, "rooms": len(_rooms), "bytes": _total_size}
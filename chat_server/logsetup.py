@@ -0,0 +1,116 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, UTC
+from .ratelimit import TokenBucket
+from .config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_EVENT_MAX_PER_SEC
+
+# Logging off the event loop. Records are put on a queue as they are, without
+# being formatted, and a background thread formats and writes them; the loop
+# pays for a filter check and a queue put.
+#
+# Hot-path call sites log with %-style arguments and an `event` name, e.g.
+#   logging.info("User '%s' joined room '%s'", userId, roomId,
+#                extra={"event": "room.join", "userId": userId, "roomId": roomId})
+# Events are sampled at LOG_SAMPLE_RATE and capped at LOG_EVENT_MAX_PER_SEC each,
+# so their cost stops growing with traffic; the next record of an event that
+# gets through carries a "suppressed" count. Records without an event are never
+# dropped. LOG_FORMAT=json writes one JSON object per line, with the extra fields
+# as keys; LOG_FORMAT=text keeps the stdlib's "LEVEL:logger:message" lines.
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_pid = None
+
+stats = {"dropped_sampled": 0, "dropped_capped": 0}
+
+class EventSampler(logging.Filter):
+    """Sample and rate-cap records that carry an `event` attribute."""
+
+    def __init__(self, rate, per_second):
+        super().__init__()
+        self.rate = rate
+        self.per_second = per_second
+        self._buckets = {}
+        self._suppressed = {}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event is None:
+            return True
+        if self.rate < 1 and random.random() >= self.rate:
+            stats["dropped_sampled"] += 1
+            self._suppressed[event] = self._suppressed.get(event, 0) + 1
+            return False
+        if self.per_second:
+            bucket = self._buckets.get(event)
+            if bucket is None:
+                bucket = self._buckets[event] = TokenBucket(self.per_second, self.per_second)
+            if bucket.take(time.monotonic()):
+                stats["dropped_capped"] += 1
+                self._suppressed[event] = self._suppressed.get(event, 0) + 1
+                return False
+        suppressed = self._suppressed.pop(event, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the writer thread."""
+
+    def prepare(self, record):
+        # Tracebacks have to be rendered now, while the frames still exist.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+def configure():
+    """Route the root logger through the background writer. Safe to call again after fork()."""
+    global _listener, _pid
+    if _pid == os.getpid():
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        # After a fork the inherited handler feeds a queue nobody reads.
+        root.removeHandler(handler)
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(logging.BASIC_FORMAT))
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(EventSampler(LOG_SAMPLE_RATE, LOG_EVENT_MAX_PER_SEC))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    _pid = os.getpid()
+    atexit.register(flush)
+
+def flush():
+    """Write out everything queued and stop the writer thread."""
+    global _pid
+    if _listener is not None and _pid == os.getpid():
+        _listener.stop()
+        _pid = None
@@ -1,10 +1,35 @@
+import argparse
 import asyncio
 import logging
-import websockets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
 import signal
-from config import DATABASE_URL, SERVER_HOST, SERVER_PORT
-from db import init_db_pool, test_db_connection
-from handlers import chat_handler
+from websockets.legacy.server import serve
+from .config import (
+    DATABASE_URL, SERVER_HOST, SERVER_PORT, BROKER_URL, DB_AUTO_MIGRATE,
+    WS_MAX_QUEUE, WS_READ_LIMIT, WS_WRITE_LIMIT, WS_MAX_SIZE,
+    DRAIN_SECONDS, HANDOFF_TIMEOUT, PROFILE_ENABLED,
+)
+from . import db
+from .db import init_db_pool, close_db_pool, test_db_connection, db_health_loop
+from .migrations import migrate
+from .partitions import maintain, partition_loop
+from .handlers import chat_handler, deliver_remote
+from .writer import start_writer, stop_writer
+from .bus import start_bus, stop_bus
+from .broker import start_broker, stop_broker
+from .auth import prefetch_certs
+from .codec import available_subprotocols
+from .compression import server_extensions
+from .drain import drain_sessions
+from .admission import ChatServerProtocol
+from . import logsetup
+from . import metrics
+from . import profiling
 import os
 
 
@@ -12,44 +37,226 @@ async def health_check(path, request_headers):
     """Handle health check requests from Render and other monitoring services"""
     if path == "/health":
         logging.info("Health check requested")
-        
+
         return (200, [("Content-Type", "text/plain")], b"OK")
-    
-   
+
+    if path == "/metrics":
+        return (200, [("Content-Type", "text/plain; version=0.0.4")], metrics.render().encode())
+
+
     return None
 
-async def shutdown(server):
+# Zero-downtime restart (SIGUSR2): the running process starts a copy of itself
+# on the same listening sockets, waits for it to report that it is accepting,
+# then drains. Both accept from the same sockets meanwhile, so no connection
+# is refused.
+LISTEN_FDS_ENV = "CHAT_LISTEN_FDS"
+READY_FD_ENV = "CHAT_READY_FD"
+
+def inherited_sockets():
+    """Listening sockets passed down by a predecessor during a handoff."""
+    fds = os.environ.pop(LISTEN_FDS_ENV, "")
+    return [socket.socket(fileno=int(fd)) for fd in fds.split(",") if fd]
+
+def signal_ready():
+    """Tell the predecessor (if any) that this process is accepting connections."""
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd:
+        os.write(int(fd), b"1")
+        os.close(int(fd))
+
+def restart_command():
+    """Command line that starts another copy of this process."""
+    spec = sys.modules["__main__"].__spec__
+    if spec is None:
+        # Started as a script, e.g. the `chat-server` console entry point.
+        return [sys.executable, *sys.argv]
+    # Started with -m; sys.argv[0] is the module's file, which can't run on its own.
+    return [sys.executable, "-m", spec.name.removesuffix(".__main__"), *sys.argv[1:]]
+
+async def hand_off(servers):
+    """Start a successor on our listening sockets. Returns True once it is accepting."""
+    fds = [sock.fileno() for server in servers for sock in server.sockets]
+    read_fd, write_fd = os.pipe()
+    env = {**os.environ, LISTEN_FDS_ENV: ",".join(map(str, fds)), READY_FD_ENV: str(write_fd)}
+    successor = subprocess.Popen(restart_command(), env=env, pass_fds=[*fds, write_fd])
+    os.close(write_fd)
+    loop = asyncio.get_running_loop()
+    try:
+        ready = await asyncio.wait_for(loop.run_in_executor(None, os.read, read_fd, 1), HANDOFF_TIMEOUT)
+    except asyncio.TimeoutError:
+        ready = b""
+    if ready != b"1":
+        # Killing it closes the pipe, which also unblocks a read still waiting in the executor.
+        successor.kill()
+        os.close(read_fd)
+        logging.error("Handoff failed: successor did not start accepting; still serving")
+        return False
+    os.close(read_fd)
+    logging.info(f"Successor {successor.pid} is accepting connections")
+    return True
+
+async def shutdown(servers):
     logging.info("Shutdown sequence started...")
-    server.close()
-    await server.wait_closed()
+    # Stop accepting, then close clients gradually instead of all at once.
+    for server in servers:
+        server.close(close_connections=False)
+    await drain_sessions(DRAIN_SECONDS)
+    for server in servers:
+        await server.wait_closed()
+    await stop_writer()
 
-async def main():
-    logging.basicConfig(level=logging.INFO)
-    logging.info("Starting server...")
-    db_pool = init_db_pool(DATABASE_URL)
+async def start_database():
+    """Open the DB pool and bring the schema up to date. False if the database is unusable."""
+    await init_db_pool(DATABASE_URL)
     logging.info("Database pool initialized.")
-    if not test_db_connection():
-        logging.error("Database connection test failed. Exiting.")
-        return
+    if not await test_db_connection():
+        return False
     logging.info("Database connection test succeeded.")
+    if db.db_pool is not None:
+        # No pool means a stand-in DB (bench_server.py); there is no schema to manage.
+        if DB_AUTO_MIGRATE:
+            await migrate(db.db_pool)
+        # Today's partition has to exist before the writer inserts anything;
+        # retiring old ones waits for partition_loop, after we're accepting.
+        await maintain(db.db_pool, retire=False)
+    return True
+
+async def bind(workers):
+    """Create the listening servers without accepting yet."""
+    serve_options = dict(
+        create_protocol=ChatServerProtocol,
+        process_request=health_check,
+        subprotocols=available_subprotocols(),
+        compression=None,
+        extensions=server_extensions(),
+        max_size=WS_MAX_SIZE,
+        max_queue=WS_MAX_QUEUE,
+        read_limit=WS_READ_LIMIT,
+        write_limit=WS_WRITE_LIMIT,
+        # Passed through to loop.create_server: accept only once startup is done.
+        start_serving=False,
+    )
+    inherited = inherited_sockets()
+    if inherited:
+        return [await serve(chat_handler, sock=sock, **serve_options) for sock in inherited]
+    return [await serve(
+        chat_handler,
+        SERVER_HOST,
+        SERVER_PORT,
+        # Lets every worker process bind the same port; the kernel balances accepts.
+        reuse_port=workers > 1,
+        **serve_options
+    )]
+
+async def _timed(aw):
+    started = time.perf_counter()
+    result = await aw
+    return result, (time.perf_counter() - started) * 1000
+
+async def main(worker_id=0, workers=1, bus_dir=None):
+    started = time.perf_counter()
+    logsetup.configure()
+    logging.info("Starting server...")
     loop = asyncio.get_running_loop()
-    stop = loop.create_future()
+    signals = asyncio.Queue()
     logging.info("Setting up signal handlers...")
     if os.name != 'nt':
-        loop.add_signal_handler(signal.SIGINT, stop.set_result, None)
-        loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
-        
+        loop.add_signal_handler(signal.SIGINT, signals.put_nowait, "stop")
+        loop.add_signal_handler(signal.SIGTERM, signals.put_nowait, "stop")
+        if workers == 1:
+            # Worker mode restarts by starting a new instance on the shared port instead.
+            loop.add_signal_handler(signal.SIGUSR2, signals.put_nowait, "handoff")
+        loop.add_signal_handler(signal.SIGUSR1, profiling.toggle, loop)
+    if PROFILE_ENABLED:
+        profiling.start(loop)
+
+    # The socket is bound while the pool connects and the signing certs are
+    # fetched; nothing is accepted until all three are done.
     logging.info("Starting WebSocket server...")
-    server = await websockets.serve(
-        chat_handler,
-        SERVER_HOST,
-        SERVER_PORT,
-        process_request=health_check  
+    servers, (db_ok, db_ms), (_, certs_ms) = await asyncio.gather(
+        bind(workers), _timed(start_database()), _timed(prefetch_certs()),
+    )
+    if not db_ok:
+        logging.error("Database connection test failed. Exiting.")
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        await close_db_pool()
+        return
+    start_writer()
+    health_task = asyncio.create_task(db_health_loop())
+    lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+    if BROKER_URL:
+        # The broker reaches every node, sibling workers included, so the local bus isn't needed.
+        await start_broker(deliver_remote)
+    elif bus_dir:
+        await start_bus(bus_dir, worker_id, workers, deliver_remote)
+    for server in servers:
+        await server.start_serving()
+    partition_task = asyncio.create_task(partition_loop(db.db_pool)) if db.db_pool is not None else None
+    ready_ms = (time.perf_counter() - started) * 1000
+    logging.info(
+        f"Server running on ws://{SERVER_HOST}:{SERVER_PORT} "
+        f"(ready in {ready_ms:.0f} ms; database {db_ms:.0f} ms, signing certs {certs_ms:.0f} ms)"
     )
-    #server = await websockets.serve(chat_handler, SERVER_HOST, SERVER_PORT)
-    logging.info(f"Server running on ws://{SERVER_HOST}:{SERVER_PORT}")
-    await stop
-    await shutdown(server)
+    signal_ready()
+    while await signals.get() == "handoff" and not await hand_off(servers):
+        pass
+    await shutdown(servers)
+    profiling.stop()
+    stop_bus()
+    await stop_broker()
+    health_task.cancel()
+    lag_task.cancel()
+    if partition_task:
+        partition_task.cancel()
+    await close_db_pool()
+
+def run_workers(workers):
+    """Fork one server process per worker, all sharing the listening port."""
+    bus_dir = tempfile.mkdtemp(prefix="chat-bus-")
+    pids = []
+    for worker_id in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                asyncio.run(main(worker_id, workers, bus_dir))
+            except Exception:
+                logging.exception(f"Worker {worker_id} crashed")
+                code = 1
+            logsetup.flush()
+            os._exit(code)
+        pids.append(pid)
+
+    def forward(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGUSR1, forward)  # profile every worker
+    logging.info(f"Started {workers} workers: {pids}")
+    for pid in pids:
+        os.waitpid(pid, 0)
+    shutil.rmtree(bus_dir, ignore_errors=True)
+
+def cli(argv=None):
+    """Console entry point (`chat-server`, `python -m chat_server`)."""
+    parser = argparse.ArgumentParser(prog="chat-server", description="WebSocket chat server")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes sharing the port")
+    args = parser.parse_args(argv)
+    if args.workers > 1:
+        if os.name == 'nt':
+            parser.error("--workers requires a platform with fork() and SO_REUSEPORT")
+        logsetup.configure()
+        run_workers(args.workers)
+    else:
+        asyncio.run(main())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    cli()
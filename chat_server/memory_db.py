@@ -0,0 +1,105 @@
+"""In-memory stand-in for db.py, used by bench_server.py in place of PostgreSQL.
+
+Implements the same coroutine API as db.py so the rest of the server runs unchanged.
+"""
+import asyncio
+import itertools
+from collections import defaultdict
+from datetime import datetime, UTC
+from .db import decode_cursor, decode_search_cursor, page_from_messages, search_page
+
+__all__ = [
+    "init_db_pool", "close_db_pool", "test_db_connection", "check_db_health",
+    "db_health_loop", "save_message_to_db", "save_messages_batch",
+    "fetch_messages_page", "fetch_messages_keyset", "reserve_seqs",
+    "fetch_messages_after_seq", "search_messages",
+]
+
+# roomId -> list of (timestamp, id, userId, text, seq), oldest first
+_messages = defaultdict(list)
+_ids = itertools.count(1)
+_seqs = defaultdict(int)
+
+async def init_db_pool(dsn):
+    return None
+
+async def close_db_pool():
+    pass
+
+async def test_db_connection():
+    return True
+
+async def check_db_health(timeout=5):
+    return True
+
+async def db_health_loop():
+    await asyncio.Event().wait()
+
+async def save_message_to_db(roomId, userId, text):
+    _messages[roomId].append((datetime.now(UTC), next(_ids), userId, text, None))
+
+async def save_messages_batch(rows):
+    for roomId, userId, text, timestamp, seq in rows:
+        _messages[roomId].append((timestamp, next(_ids), userId, text, seq))
+    return len(rows)
+
+def _key(cursor, default_id):
+    """Sort key of a cursor, and of a row, comparable with each other."""
+    timestamp, id, seq = decode_cursor(cursor)
+    if seq is not None:
+        return (timestamp, seq), lambda row: (row[0], row[4] or 0)
+    return (timestamp, id if id is not None else default_id), lambda row: row[:2]
+
+async def fetch_messages_page(roomId, before=None, limit=50, after=None):
+    rows = _messages.get(roomId, [])
+    if after:
+        key, row_key = _key(after, float("inf"))
+        page = [row for row in rows if row_key(row) > key][:limit][::-1]
+    else:
+        if before:
+            key, row_key = _key(before, 0)
+            rows = [row for row in rows if row_key(row) < key]
+        page = rows[-limit:][::-1]
+    return page_from_messages([_message(row) for row in page])
+
+def _message(row):
+    timestamp, id, userId, text, seq = row
+    return {"id": id, "userId": userId, "text": text, "timestamp": timestamp.isoformat(), "seq": seq}
+
+async def reserve_seqs(roomId, count):
+    # Per process: the stand-in isn't shared between workers either.
+    _seqs[roomId] += count
+    return _seqs[roomId] - count + 1
+
+async def fetch_messages_after_seq(roomId, after, limit):
+    rows = sorted((row for row in _messages.get(roomId, []) if row[4] is not None and row[4] > after),
+                  key=lambda row: row[4])
+    return [_message(row) for row in rows[:limit]]
+
+async def fetch_messages_keyset(roomId, before=None, limit=50, after=None):
+    # Like db.fetch_messages_keyset, a malformed cursor gets an empty page.
+    try:
+        return await fetch_messages_page(roomId, before, limit, after)
+    except ValueError:
+        return page_from_messages([])
+
+async def search_messages(roomId, query, limit=20, cursor=None):
+    # Crude stand-in for Postgres full-text search: every query word must
+    # appear, ranked by how often they do relative to the message length.
+    terms = query.lower().split()
+    if not terms:
+        return search_page([])
+    results = []
+    for row in _messages.get(roomId, []):
+        words = (row[3] or "").lower().split()
+        if all(term in words for term in terms):
+            rank = sum(words.count(term) for term in terms) / len(words)
+            results.append((rank, row[0], row[1], row))
+    results.sort(reverse=True)
+    if cursor:
+        try:
+            key = decode_search_cursor(cursor)
+        except ValueError:
+            return search_page([])
+        results = [result for result in results if result[:3] < key]
+    return search_page([{**_message(row), "rank": rank} for rank, _, _, row in results[:limit]])
@@ -0,0 +1,128 @@
+import asyncio
+from bisect import bisect_left
+
+# Lightweight in-process metrics rendered in the Prometheus text format at /metrics.
+# Hot paths only bump ints and do one bisect, so this stays on under full load.
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+class Counter:
+    __slots__ = ("name", "help", "value")
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+class Histogram:
+    __slots__ = ("name", "help", "bounds", "counts", "sum", "count")
+
+    def __init__(self, name, help, bounds=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+MESSAGES_IN = Counter("chat_messages_in_total", "Frames received from clients.")
+MESSAGES_OUT = Counter("chat_messages_out_total", "Frames queued to clients.")
+CONNECTIONS_TOTAL = Counter("chat_connections_total", "WebSocket connections accepted.")
+
+BROADCAST_SECONDS = Histogram("chat_broadcast_seconds", "Time to fan a broadcast out to local room members.")
+DB_SAVE_SECONDS = Histogram("chat_db_save_seconds", "Latency of message persistence (one batch or row).")
+DB_FETCH_SECONDS = Histogram("chat_db_fetch_seconds", "Latency of history page queries.")
+SEQ_RESERVE_SECONDS = Histogram("chat_seq_reserve_seconds", "Latency of reserving a block of sequence numbers.")
+VERIFY_SECONDS = Histogram("chat_token_verify_seconds", "Latency of Firebase token verification.")
+LOOP_LAG_SECONDS = Histogram("chat_event_loop_lag_seconds", "How late the event loop ran a scheduled wakeup.")
+
+LOOP_LAG_INTERVAL = 0.25
+
+async def monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
+
+def _gauge(name, help, value):
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+def _executor_queue_depth():
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    work_queue = getattr(executor, "_work_queue", None)
+    return work_queue.qsize() if work_queue is not None else 0
+
+def _stats_lines(prefix, stats):
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, (int, float)):
+            lines += _gauge(f"{prefix}_{key}", f"{prefix} {key}", value)
+    return lines
+
+def render():
+    # Imported here: these modules import metrics for their own instrumentation.
+    from . import admission, archive, auth, bus, broker, compression, drain, fanout, history, logsetup, partitions, pools, presence, profiling, ratelimit, registry, sequence, writer
+
+    lines = []
+    lines += _gauge("chat_active_connections", "Open WebSocket connections.", registry.connection_count())
+    lines += _gauge("chat_admitted_connections", "Admitted connections, including ones still handshaking.", admission.open_connections())
+    lines += _gauge("chat_rooms", "Rooms with at least one local member.", registry.room_count())
+    lines += _gauge("chat_room_members", "Room memberships on this process.", registry.membership_count())
+    lines += _gauge("chat_session_overhead_bytes", "Approximate registry bytes per idle session.", registry.session_overhead_bytes())
+    lines += _gauge("chat_executor_queue_depth", "Work items waiting for a default-executor thread.", _executor_queue_depth())
+    for metric in (
+        MESSAGES_IN, MESSAGES_OUT, CONNECTIONS_TOTAL, BROADCAST_SECONDS,
+        DB_SAVE_SECONDS, DB_FETCH_SECONDS, SEQ_RESERVE_SECONDS, VERIFY_SECONDS, LOOP_LAG_SECONDS,
+    ):
+        lines += metric.render()
+    for metric in profiling.handler_histograms():
+        lines += metric.render()
+    lines += _stats_lines("chat_writer", writer.get_writer_stats())
+    lines += _stats_lines("chat_history_cache", history.get_history_stats())
+    lines += _stats_lines("chat_auth_cache", auth.stats)
+    lines += _stats_lines("chat_outbox", fanout.stats)
+    lines += _stats_lines("chat_compression", compression.stats)
+    lines += _stats_lines("chat_bus", bus.stats)
+    lines += _stats_lines("chat_broker", broker.stats)
+    lines += _stats_lines("chat_presence", presence.stats)
+    lines += _stats_lines("chat_sequence", sequence.stats)
+    lines += _stats_lines("chat_ratelimit", ratelimit.stats)
+    lines += _stats_lines("chat_drain", drain.stats)
+    lines += _stats_lines("chat_partitions", partitions.stats)
+    lines += _stats_lines("chat_archive", archive.stats)
+    lines += _stats_lines("chat_admission", admission.stats)
+    lines += _stats_lines("chat_profiling", profiling.stats)
+    lines += _stats_lines("chat_log", logsetup.stats)
+    for pool in pools.POOLS:
+        lines += _stats_lines(f"chat_pool_{pool.name.replace('-', '_')}", pool.get_stats())
+    return "\n".join(lines) + "\n"
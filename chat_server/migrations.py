@@ -0,0 +1,233 @@
+"""Versioned schema for the messages table.
+
+Migrations are applied in order at startup (DB_AUTO_MIGRATE) or from the CLI:
+
+    python -m chat_server.migrations              # apply pending migrations
+    python -m chat_server.migrations --check-plan # also check messages_room_ts_id_seq_idx serves history
+"""
+import asyncio
+import json
+import logging
+import sys
+from datetime import datetime, UTC
+
+# Serialises migrations across workers/nodes starting at the same time.
+_ADVISORY_LOCK_ID = 0x63686174  # "chat"
+
+# (version, name, sql, transactional). Non-transactional steps are needed for
+# CREATE INDEX CONCURRENTLY, which can't run inside a transaction block. A step
+# may be an async function of the connection instead of SQL; such steps must be
+# safe to re-run after failing part way.
+MIGRATIONS = [
+    (1, "create messages table", """
+        CREATE TABLE IF NOT EXISTS messages (
+            id BIGSERIAL PRIMARY KEY,
+            roomId TEXT NOT NULL,
+            userId TEXT NOT NULL,
+            text TEXT,
+            timestamp TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        -- Tables created before this schema existed may lack the tie-breaker column.
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+    """, True),
+    (2, "history covering index", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_room_ts_id_idx
+        ON messages (roomId, timestamp DESC, id DESC)
+        INCLUDE (userId, text)
+    """, False),
+    # The existing table becomes the first partition, covering everything up to
+    # tomorrow (UTC); partitions.py creates one partition per day after that.
+    # LIKE keeps the column types identical, which ATTACH requires. Attaching
+    # scans the old table once to check the bound.
+    (3, "partition messages by day", """
+        ALTER TABLE messages RENAME TO messages_legacy;
+        ALTER INDEX messages_room_ts_id_idx RENAME TO messages_legacy_room_ts_id_idx;
+        ALTER TABLE messages_legacy ALTER COLUMN timestamp SET NOT NULL;
+        CREATE TABLE messages (LIKE messages_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp);
+        ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+        CREATE INDEX messages_room_ts_id_idx ON messages (roomId, timestamp DESC, id DESC) INCLUDE (userId, text);
+        ALTER TABLE messages ATTACH PARTITION messages_legacy
+            FOR VALUES FROM (MINVALUE) TO ((date_trunc('day', now() AT TIME ZONE 'UTC') + interval '1 day') AT TIME ZONE 'UTC');
+    """, True),
+    # Per-room sequence numbers (see sequence.py). The covering index is rebuilt
+    # to include seq so history pages stay index-only; see create_partitioned_index
+    # for how it is built without blocking the writer.
+    (4, "per-room sequence numbers", lambda conn: _add_seq(conn), False),
+    # Full-text search (db.search_messages). An expression index keeps itself
+    # current on every insert/COPY without a stored column or trigger; the
+    # expression must match SEARCH_*_SQL exactly for the planner to use it.
+    (5, "full-text search index", lambda conn: create_partitioned_index(
+        conn, "messages_text_search_idx", "USING GIN (to_tsvector('simple', text))"
+    ), False),
+    # Sequence numbers are reserved in blocks from one counter row per room,
+    # shared by every worker and node (db.reserve_seqs). Rows are seeded lazily,
+    # from the room's highest stored seq, by the room's first reservation.
+    (6, "shared per-room sequence counters", """
+        CREATE TABLE IF NOT EXISTS room_seqs (
+            roomId TEXT PRIMARY KEY,
+            seq BIGINT NOT NULL
+        );
+    """, True),
+]
+
+LIST_PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'messages'::regclass
+"""
+
+# Whether a partition already has an index attached to the given parent index.
+INDEX_ATTACHED_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+        WHERE i.inhparent = to_regclass($1) AND x.indrelid = to_regclass($2)
+    )
+"""
+
+INDEX_VALID_SQL = "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)"
+
+async def create_partitioned_index(conn, name, definition):
+    """Create index `name` on messages without blocking writes.
+
+    `definition` is what follows "ON messages", e.g. "(roomId, seq)". A plain
+    CREATE INDEX on the parent builds every partition's index in one transaction
+    and holds off inserts until it's done. Instead the parent's index is created
+    ON ONLY messages, which is instant and leaves it invalid; each partition is
+    then indexed CONCURRENTLY and attached, and the parent's index becomes valid
+    once every partition has one. Partitions created meanwhile get theirs from
+    the parent. Safe to re-run after failing part way.
+    """
+    await conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY messages {definition}")
+    suffix = name.removeprefix("messages_")
+    for row in await conn.fetch(LIST_PARTITIONS_SQL):
+        partition = row["relname"]
+        if await conn.fetchval(INDEX_ATTACHED_SQL, name, partition):
+            continue
+        index = f"{partition}_{suffix}"
+        if await conn.fetchval(INDEX_VALID_SQL, index) is False:
+            # Left behind by an interrupted CONCURRENTLY build.
+            await conn.execute(f"DROP INDEX CONCURRENTLY {index}")
+        await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {partition} {definition}")
+        await conn.execute(f"ALTER INDEX {name} ATTACH PARTITION {index}")
+
+async def _add_seq(conn):
+    await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT")
+    await create_partitioned_index(
+        conn, "messages_room_ts_id_seq_idx", "(roomId, timestamp DESC, id DESC) INCLUDE (userId, text, seq)"
+    )
+    await conn.execute("DROP INDEX IF EXISTS messages_room_ts_id_idx")
+    await create_partitioned_index(conn, "messages_room_seq_idx", "(roomId, seq)")
+
+CREATE_VERSIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+async def migrate(pool):
+    """Apply every migration newer than the recorded schema version."""
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", _ADVISORY_LOCK_ID)
+        try:
+            await conn.execute(CREATE_VERSIONS_SQL)
+            applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+            for version, name, sql, transactional in MIGRATIONS:
+                if version in applied:
+                    continue
+                logging.info(f"Applying migration {version}: {name}")
+                if callable(sql):
+                    await sql(conn)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+                    )
+                elif transactional:
+                    async with conn.transaction():
+                        await conn.execute(sql)
+                        await conn.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+                        )
+                else:
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+                    )
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", _ADVISORY_LOCK_ID)
+
+HISTORY_INDEX = "messages_room_ts_id_seq_idx"
+
+# The partitioned index a partition's index is attached to; the index itself if
+# it isn't attached to one.
+PARENT_INDEX_SQL = """
+    SELECT coalesce(parent.relname, child.relname)
+    FROM pg_class child
+    LEFT JOIN pg_inherits ON inhrelid = child.oid
+    LEFT JOIN pg_class parent ON parent.oid = inhparent
+    WHERE child.relname = $1
+"""
+
+def scan_nodes(node):
+    """Plan nodes that read a relation, below any Limit/Append wrappers."""
+    if "Relation Name" in node:
+        return [node]
+    return [scan for child in node.get("Plans", ()) for scan in scan_nodes(child)]
+
+async def explain_history_query(pool, roomId="plan-check", before=None, force_index=False):
+    """EXPLAIN the keyset history query and return the top plan node.
+
+    With force_index, sequential and bitmap scans are disabled, so small or
+    empty partitions still show which index the planner would pick.
+    """
+    from .db import FETCH_BEFORE_SQL
+    async with pool.acquire() as conn:
+        # Index-only scans need the visibility map to be current.
+        await conn.execute("VACUUM (ANALYZE) messages")
+        async with conn.transaction():
+            if force_index:
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                await conn.execute("SET LOCAL enable_bitmapscan = off")
+            plan = await conn.fetchval(
+                f"EXPLAIN (FORMAT JSON) {FETCH_BEFORE_SQL}",
+                roomId, before or datetime.now(UTC), 2**62, 50,
+            )
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return plan[0]["Plan"]
+
+async def history_plan_problems(pool, node):
+    """Scans in a history plan that aren't index-only scans of HISTORY_INDEX."""
+    scans = scan_nodes(node)
+    if not scans:
+        return ["no scan nodes in plan"]
+    problems = []
+    async with pool.acquire() as conn:
+        for scan in scans:
+            index = scan.get("Index Name")
+            parent = await conn.fetchval(PARENT_INDEX_SQL, index) if index else None
+            if scan["Node Type"] != "Index Only Scan" or parent != HISTORY_INDEX:
+                problems.append(f"{scan['Node Type']} on {scan['Relation Name']} (index {index})")
+    return problems
+
+async def _main(argv):
+    import asyncpg
+    from .config import DATABASE_URL
+    logging.basicConfig(level=logging.INFO)
+    pool = await asyncpg.create_pool(dsn=DATABASE_URL, min_size=1, max_size=2)
+    try:
+        await migrate(pool)
+        if "--check-plan" in argv:
+            node = await explain_history_query(pool, force_index=True)
+            print(json.dumps(node, indent=2))
+            problems = await history_plan_problems(pool, node)
+            if problems:
+                print(f"History query is not served by index-only scans of {HISTORY_INDEX}:", file=sys.stderr)
+                for problem in problems:
+                    print(f"  {problem}", file=sys.stderr)
+                return 1
+        return 0
+    finally:
+        await pool.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,111 @@
+"""Hot-tier partition maintenance for the messages table (see migration 3).
+
+Keeps one partition per UTC day from today through PARTITION_PREMAKE_DAYS
+ahead. Partitions that ended more than MESSAGES_HOT_DAYS ago are exported to
+the archive, then detached and dropped. Only one process runs a maintenance
+pass at a time.
+"""
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta, UTC
+from . import archive
+from .config import MESSAGES_HOT_DAYS, PARTITION_PREMAKE_DAYS, PARTITION_CHECK_INTERVAL
+
+_ADVISORY_LOCK_ID = 0x63686175  # one past migrations.py's lock
+
+LIST_PARTITIONS_SQL = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'messages'::regclass
+"""
+
+_BOUND = re.compile(r"FROM \((MINVALUE|'[^']*')\) TO \((MAXVALUE|'[^']*')\)")
+
+stats = {"partitions": 0, "created": 0, "retired": 0, "errors": 0}
+
+def _parse_bound(value):
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+def partition_name(day):
+    return f"messages_p{day:%Y%m%d}"
+
+async def list_partitions(conn):
+    """[(name, lower, upper)] sorted by upper bound; None means unbounded."""
+    partitions = []
+    for name, bound in await conn.fetch(LIST_PARTITIONS_SQL):
+        match = _BOUND.search(bound)
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    partitions.sort(key=lambda p: (p[2] is None, p[2]))
+    return partitions
+
+def _overlaps(partitions, lower, upper):
+    return any(
+        (p_lower is None or p_lower < upper) and (p_upper is None or lower < p_upper)
+        for _, p_lower, p_upper in partitions
+    )
+
+async def ensure_partitions(conn, now=None):
+    """Create any missing daily partitions up to PARTITION_PREMAKE_DAYS ahead."""
+    now = now or datetime.now(UTC)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    partitions = await list_partitions(conn)
+    for offset in range(PARTITION_PREMAKE_DAYS + 1):
+        lower = today + timedelta(days=offset)
+        upper = lower + timedelta(days=1)
+        if _overlaps(partitions, lower, upper):
+            continue
+        name = partition_name(lower)
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        partitions.append((name, lower, upper))
+        stats["created"] += 1
+        logging.info(f"Created partition {name}")
+
+async def retire_partitions(conn, now=None):
+    """Archive and drop partitions that ended more than MESSAGES_HOT_DAYS ago."""
+    if not archive.enabled() or not archive.check_available():
+        return
+    now = now or datetime.now(UTC)
+    cutoff = now - timedelta(days=MESSAGES_HOT_DAYS)
+    for name, _, upper in await list_partitions(conn):
+        if upper is None or upper > cutoff:
+            break
+        rows = await archive.export_partition(conn, name, upper)
+        # The archive file is in place before the rows leave the hot tier.
+        await conn.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+        await conn.execute(f"DROP TABLE {name}")
+        stats["retired"] += 1
+        logging.info(f"Retired partition {name} ({rows} rows archived)")
+
+async def maintain(pool, now=None, retire=True):
+    """One maintenance pass; skipped if another process holds the lock.
+
+    With retire=False only missing partitions are created, which is all
+    startup needs; archiving can take minutes and is left to partition_loop.
+    """
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", _ADVISORY_LOCK_ID):
+            return
+        try:
+            await ensure_partitions(conn, now)
+            if retire:
+                await retire_partitions(conn, now)
+            stats["partitions"] = len(await list_partitions(conn))
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", _ADVISORY_LOCK_ID)
+
+async def partition_loop(pool):
+    """Run full maintenance now, in the background, then every PARTITION_CHECK_INTERVAL seconds."""
+    while True:
+        try:
+            await maintain(pool)
+        except Exception as e:
+            stats["errors"] += 1
+            logging.error(f"Partition maintenance failed: {e}")
+        await asyncio.sleep(PARTITION_CHECK_INTERVAL)
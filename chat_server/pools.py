@@ -0,0 +1,123 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .config import (
+    AUTH_POOL_SIZE, AUTH_POOL_QUEUE, AUTH_TIMEOUT,
+    DB_READ_POOL_SIZE, DB_READ_POOL_QUEUE, DB_READ_TIMEOUT,
+    DB_WRITE_POOL_SIZE, DB_WRITE_POOL_QUEUE, DB_WRITE_TIMEOUT,
+    ARCHIVE_POOL_SIZE, ARCHIVE_POOL_QUEUE,
+)
+
+# Bounded pools for work that can stall. Each subsystem gets its own worker
+# threads (for blocking calls) and its own concurrency limit (for async DB
+# calls), so a storm of token checks can't starve message persistence and a
+# burst of history reads can't take every database connection.
+#
+# A pool admits `size` calls at a time and lets `queue` more wait; anything
+# beyond that is rejected at once with Saturated rather than piling up. Calls
+# that take longer than the pool's timeout, waiting included, raise TimeoutError.
+
+class Saturated(Exception):
+    """Raised instead of queueing when a pool has no room left."""
+
+    def __init__(self, pool):
+        super().__init__(f"{pool} pool is saturated")
+        self.pool = pool
+
+class Pool:
+    def __init__(self, name, size, queue, timeout=None):
+        self.name = name
+        self.size = size
+        self.queue = queue
+        self.timeout = timeout
+        self.pending = 0  # admitted calls, running or waiting
+        self.active = 0
+        self._slots = asyncio.Semaphore(size)
+        self._executor = None
+        self.stats = {"completed": 0, "failed": 0, "rejected": 0, "timeouts": 0, "busy_seconds": 0.0}
+
+    def _admit(self):
+        if self.pending >= self.size + self.queue:
+            self.stats["rejected"] += 1
+            raise Saturated(self.name)
+        self.pending += 1
+
+    def _done(self, started, ok):
+        self.pending -= 1
+        self.active -= 1
+        self.stats["busy_seconds"] += time.perf_counter() - started
+        self.stats["completed" if ok else "failed"] += 1
+
+    def _work(self, loop, fn, args):
+        started = time.perf_counter()
+        loop.call_soon_threadsafe(self._started)
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            loop.call_soon_threadsafe(self._done, started, ok)
+
+    def _started(self):
+        self.active += 1
+
+    async def run(self, fn, *args):
+        """Run a blocking function on this pool's threads."""
+        self._admit()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.size, thread_name_prefix=self.name)
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(self._work, loop, fn, args)
+        # A call still waiting for a thread never runs once it's given up on;
+        # one already running keeps its slot until the thread returns.
+        future.add_done_callback(lambda f: f.cancelled() and loop.call_soon_threadsafe(self._cancelled))
+        try:
+            async with asyncio.timeout(self.timeout):
+                return await asyncio.wrap_future(future)
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+
+    def _cancelled(self):
+        self.pending -= 1
+
+    async def call(self, fn, *args, **kwargs):
+        """Await `fn(*args, **kwargs)` within this pool's concurrency limit."""
+        self._admit()
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with self._slots:
+                    self.active += 1
+                    started, ok = time.perf_counter(), False
+                    try:
+                        result = await fn(*args, **kwargs)
+                        ok = True
+                        return result
+                    finally:
+                        self.active -= 1
+                        self.stats["busy_seconds"] += time.perf_counter() - started
+                        self.stats["completed" if ok else "failed"] += 1
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        finally:
+            self.pending -= 1
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "size": self.size,
+            "active": self.active,
+            "queued": self.pending - self.active,
+            "utilization": self.active / self.size if self.size else 0.0,
+        }
+
+auth = Pool("auth", AUTH_POOL_SIZE, AUTH_POOL_QUEUE, AUTH_TIMEOUT)
+db_read = Pool("db-read", DB_READ_POOL_SIZE, DB_READ_POOL_QUEUE, DB_READ_TIMEOUT)
+db_write = Pool("db-write", DB_WRITE_POOL_SIZE, DB_WRITE_POOL_QUEUE, DB_WRITE_TIMEOUT)
+# Parquet reads/writes run inside db-read calls and partition maintenance,
+# which already carry their own deadlines.
+archive = Pool("archive", ARCHIVE_POOL_SIZE, ARCHIVE_POOL_QUEUE)
+
+POOLS = (auth, db_read, db_write, archive)
@@ -0,0 +1,84 @@
+import asyncio
+import heapq
+from . import registry
+from .config import PRESENCE_WINDOW_MS, PRESENCE_MAX_ROOM_SIZE, PRESENCE_PAGE_SIZE
+
+# Join/leave events are collected per room for PRESENCE_WINDOW_MS and sent as a
+# single delta frame. A leave followed by a rejoin (or the reverse) inside the
+# window cancels out, so reconnect storms don't multiply announcements.
+
+_pending = {}  # roomId -> {userId: "join" | "leave"}
+
+stats = {"events": 0, "collapsed": 0, "frames": 0, "suppressed": 0}
+
+def user_joined(roomId, userId):
+    _record(roomId, userId, "join")
+
+def user_left(roomId, userId):
+    _record(roomId, userId, "leave")
+
+def _record(roomId, userId, event):
+    stats["events"] += 1
+    events = _pending.get(roomId)
+    if events is None:
+        events = _pending[roomId] = {}
+        asyncio.get_running_loop().call_later(PRESENCE_WINDOW_MS / 1000, _flush, roomId)
+    if events.get(userId, event) != event:
+        del events[userId]
+        stats["collapsed"] += 1
+    else:
+        events[userId] = event
+
+def _describe(joined, left):
+    if len(joined) == 1 and not left:
+        return f"User '{joined[0]}' joined the room."
+    if len(left) == 1 and not joined:
+        return f"User '{left[0]}' left the room."
+    parts = []
+    if joined:
+        parts.append(f"{len(joined)} user{'s' if len(joined) != 1 else ''} joined")
+    if left:
+        parts.append(f"{len(left)} user{'s' if len(left) != 1 else ''} left")
+    return ", ".join(parts) + "."
+
+def _flush(roomId):
+    # Imported here because rooms imports this module.
+    from .rooms import broadcast
+
+    events = _pending.pop(roomId, None)
+    if not events:
+        return
+    if registry.room_size(roomId) > PRESENCE_MAX_ROOM_SIZE:
+        # Large rooms get no per-user announcements; clients ask for a snapshot instead.
+        stats["suppressed"] += 1
+        return
+    joined = [userId for userId, event in events.items() if event == "join"]
+    left = [userId for userId, event in events.items() if event == "leave"]
+    # "announcement" and "message" keep older clients rendering a line of text.
+    announcement = {
+        "type": "announcement",
+        "message": _describe(joined, left),
+        "joined": joined,
+        "left": left,
+    }
+    stats["frames"] += 1
+    asyncio.ensure_future(broadcast(roomId, announcement, exclude_sender=False))
+
+def snapshot(roomId, after=None):
+    """One page of current presence for a room on this node, in userId order.
+
+    `after` is the nextCursor of the previous page; nextCursor is None on the last.
+    """
+    users = registry.room_users(roomId)
+    candidates = users if after is None else (userId for userId in users if userId > after)
+    # Only the page is sorted, not the whole room.
+    page = heapq.nsmallest(PRESENCE_PAGE_SIZE + 1, candidates)
+    more = len(page) > PRESENCE_PAGE_SIZE
+    page = page[:PRESENCE_PAGE_SIZE]
+    return {
+        "type": "presence",
+        "roomId": roomId,
+        "users": page,
+        "count": len(users),
+        "nextCursor": page[-1] if more else None,
+    }
@@ -0,0 +1,123 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from . import metrics
+from .config import PROFILE_DIR, PROFILE_SAMPLE_MS, PROFILE_SLOW_CALLBACK_MS
+
+# Opt-in profiling, cheap enough to leave on for a few minutes in production.
+# SIGUSR1 toggles it (PROFILE_ENABLED=1 starts it at boot); turning it off
+# writes the collected profile to PROFILE_DIR. While it is on:
+#
+# - handle_message records latency per message type (chat_handler_<type>_seconds);
+# - a sampler thread records the event-loop thread's stack every PROFILE_SAMPLE_MS,
+#   written as folded stacks ("frame;frame;frame count", one per line), which
+#   flamegraph.pl, speedscope and inferno read directly;
+# - the same thread watches a heartbeat the loop updates, and when the loop has
+#   been stuck in one callback for PROFILE_SLOW_CALLBACK_MS it logs that
+#   callback's stack once per stall.
+#
+# Nothing here runs on the loop except the heartbeat and one clock read per message.
+
+HANDLER_TYPES = ("message", "join", "load_chat", "sync", "search", "presence")
+
+active = False
+_stacks = Counter()
+_started_at = 0.0
+_loop = None
+_loop_thread_id = None
+_beat = 0.0
+_sampler = None
+_handler_seconds = {}
+
+stats = {"samples": 0, "slow_callbacks": 0, "max_stall_ms": 0.0, "dumps": 0}
+
+def observe(kind, seconds):
+    """Record how long handle_message took for a frame of this type."""
+    kind = kind if kind in HANDLER_TYPES else "other"
+    histogram = _handler_seconds.get(kind)
+    if histogram is None:
+        histogram = _handler_seconds[kind] = metrics.Histogram(
+            f"chat_handler_{kind}_seconds", f"Time handle_message spent on '{kind}' frames (profiling only)."
+        )
+    histogram.observe(seconds)
+
+def handler_histograms():
+    return list(_handler_seconds.values())
+
+def _heartbeat():
+    global _beat
+    _beat = time.monotonic()
+    if active:
+        _loop.call_later(PROFILE_SAMPLE_MS / 1000, _heartbeat)
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def _sample_loop():
+    interval = PROFILE_SAMPLE_MS / 1000
+    threshold = PROFILE_SLOW_CALLBACK_MS / 1000
+    reported = None  # heartbeat value of the stall already logged
+    while active:
+        time.sleep(interval)
+        frame = sys._current_frames().get(_loop_thread_id)
+        if frame is None:
+            continue
+        _stacks[_fold(frame)] += 1
+        stats["samples"] += 1
+        beat = _beat
+        stalled = time.monotonic() - beat
+        if stalled > threshold:
+            stats["max_stall_ms"] = max(stats["max_stall_ms"], stalled * 1000)
+            if reported != beat:
+                reported = beat
+                stats["slow_callbacks"] += 1
+                stack = "".join(traceback.format_stack(frame))
+                logging.warning(f"Event loop blocked for {stalled * 1000:.0f} ms so far in:\n{stack}")
+
+def start(loop):
+    """Start profiling; must be called from the event-loop thread."""
+    global active, _loop, _loop_thread_id, _sampler, _started_at
+    if active:
+        return
+    _loop, _loop_thread_id = loop, threading.get_ident()
+    _stacks.clear()
+    _started_at = time.time()
+    active = True
+    _heartbeat()
+    _sampler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+    _sampler.start()
+    logging.info(f"Profiling started (sampling every {PROFILE_SAMPLE_MS} ms)")
+
+def stop():
+    """Stop profiling and write the folded-stack profile. Returns its path."""
+    global active
+    if not active:
+        return None
+    active = False
+    _sampler.join()
+    return dump()
+
+def dump():
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"chat-{os.getpid()}-{int(_started_at)}.folded")
+    with open(path, "w") as f:
+        for stack, count in _stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    stats["dumps"] += 1
+    logging.info(f"Profiling stopped: {sum(_stacks.values())} samples written to {path}")
+    return path
+
+def toggle(loop):
+    if active:
+        stop()
+    else:
+        start(loop)
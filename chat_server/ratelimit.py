@@ -0,0 +1,131 @@
+import time
+from .config import (
+    RATE_LIMIT_ENABLED, RATE_LIMIT_DISCONNECT_AFTER,
+    RATE_FRAMES_PER_SEC, RATE_FRAMES_BURST,
+    RATE_MESSAGES_PER_SEC, RATE_MESSAGES_BURST,
+    RATE_USER_MESSAGES_PER_SEC, RATE_USER_MESSAGES_BURST,
+    RATE_ROOM_MESSAGES_PER_SEC, RATE_ROOM_MESSAGES_BURST,
+    RATE_JOINS_PER_SEC, RATE_JOINS_BURST,
+    RATE_HISTORY_PER_SEC, RATE_HISTORY_BURST,
+)
+
+# Token buckets checked on every inbound frame. Each check is a few float ops on
+# preallocated slots; nothing is allocated unless a frame is actually throttled.
+# A rate of 0 disables that bucket. Room buckets are per node.
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Spend one token; returns 0.0 on success, else seconds until one is available."""
+        tokens = self.tokens + (now - self.updated) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self.updated = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return 0.0
+        self.tokens = tokens
+        return (1 - tokens) / self.rate
+
+def _bucket(rate, burst):
+    return TokenBucket(rate, max(burst, 1)) if RATE_LIMIT_ENABLED and rate > 0 else None
+
+class ConnectionLimits:
+    """Per-connection buckets plus flood-control bookkeeping."""
+    __slots__ = ("frames", "messages", "joins", "history", "violations", "quiet_until")
+
+    def __init__(self):
+        self.frames = _bucket(RATE_FRAMES_PER_SEC, RATE_FRAMES_BURST)
+        self.messages = _bucket(RATE_MESSAGES_PER_SEC, RATE_MESSAGES_BURST)
+        self.joins = _bucket(RATE_JOINS_PER_SEC, RATE_JOINS_BURST)
+        self.history = _bucket(RATE_HISTORY_PER_SEC, RATE_HISTORY_BURST)
+        self.violations = 0      # throttled frames since the last accepted one
+        self.quiet_until = 0.0   # no further throttle notices before this time
+
+_by_user = {}  # user_id -> TokenBucket shared by all of the user's connections
+_by_room = {}  # room_id -> TokenBucket
+
+stats = {
+    "throttled_connection": 0, "throttled_user": 0, "throttled_room": 0,
+    "rejected_oversize": 0, "disconnected": 0,
+}
+
+def _shared(buckets, key, rate, burst):
+    bucket = buckets.get(key)
+    if bucket is None and RATE_LIMIT_ENABLED and rate > 0:
+        bucket = buckets[key] = TokenBucket(rate, max(burst, 1))
+    return bucket
+
+def _take(bucket, now):
+    if bucket is None:
+        return 0.0
+    wait = bucket.take(now)
+    if wait:
+        stats["throttled_connection"] += 1
+    return wait
+
+def check_frame(limits, now):
+    """Cap on all inbound frames, checked before decoding. Returns the retry delay or 0.0."""
+    return _take(limits.frames, now)
+
+def check_action(session, kind, now):
+    """Apply the buckets for a decoded frame type. Returns (scope, retry delay); scope None if allowed."""
+    limits = session.limits
+    if kind == "message":
+        scope, wait = _check_message(session, now)
+    elif kind == "join":
+        scope, wait = "connection", _take(limits.joins, now)
+    elif kind in ("load_chat", "sync", "search", "presence"):
+        scope, wait = "connection", _take(limits.history, now)
+    else:
+        return None, 0.0
+    if not wait:
+        limits.violations = 0
+        return None, 0.0
+    return scope, wait
+
+def _check_message(session, now):
+    wait = _take(session.limits.messages, now)
+    if wait:
+        return "connection", wait
+    bucket = _shared(_by_user, session.user_id, RATE_USER_MESSAGES_PER_SEC, RATE_USER_MESSAGES_BURST)
+    if bucket is not None:
+        wait = bucket.take(now)
+        if wait:
+            stats["throttled_user"] += 1
+            return "user", wait
+    bucket = _shared(_by_room, session.room_id, RATE_ROOM_MESSAGES_PER_SEC, RATE_ROOM_MESSAGES_BURST)
+    if bucket is not None:
+        wait = bucket.take(now)
+        if wait:
+            stats["throttled_room"] += 1
+            return "room", wait
+    return None, 0.0
+
+def throttled(limits, now, wait):
+    """Record a throttled frame. Returns (send_notice, disconnect)."""
+    limits.violations += 1
+    if RATE_LIMIT_DISCONNECT_AFTER and limits.violations >= RATE_LIMIT_DISCONNECT_AFTER:
+        # Frames already buffered behind the close land here too; close only once.
+        if limits.violations > RATE_LIMIT_DISCONNECT_AFTER:
+            return False, False
+        stats["disconnected"] += 1
+        return False, True
+    if now < limits.quiet_until:
+        return False, False
+    # One notice per retry window, so a flooding client can't turn throttling into fan-out.
+    limits.quiet_until = now + wait
+    return True, False
+
+def forget_user(user_id):
+    _by_user.pop(user_id, None)
+
+def forget_room(room_id):
+    _by_room.pop(room_id, None)
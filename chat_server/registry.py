@@ -0,0 +1,127 @@
+import sys
+
+# Connection/room registry. Every open socket gets one Session record; rooms and
+# users are indexed so membership, room size and presence are O(1) lookups.
+
+class Session:
+    __slots__ = ("websocket", "user_id", "room_id", "codec", "outbox", "limits")
+
+    def __init__(self, websocket, codec):
+        self.websocket = websocket
+        self.codec = codec
+        self.user_id = None
+        self.room_id = None
+        self.outbox = None
+        self.limits = None
+
+_sessions = {}        # websocket -> Session
+_by_room = {}         # room_id -> {Session: None}, insertion ordered
+_by_user = {}         # user_id -> {Session: None}
+_snapshots = {}       # room_id -> tuple of members, rebuilt after membership changes
+
+# hash, key and value pointers of one dict entry on a 64-bit build
+_DICT_ENTRY_BYTES = 24
+
+def intern_id(value):
+    """Intern a room/user id so every session referencing it shares one string."""
+    return sys.intern(value)
+
+def open_session(websocket, codec):
+    session = _sessions[websocket] = Session(websocket, codec)
+    return session
+
+def get_session(websocket):
+    return _sessions.get(websocket)
+
+def close_session(session):
+    leave_room(session)
+    set_user(session, None)
+    _sessions.pop(session.websocket, None)
+
+def set_user(session, user_id):
+    if session.user_id is not None:
+        sessions = _by_user.get(session.user_id)
+        if sessions is not None:
+            sessions.pop(session, None)
+            if not sessions:
+                del _by_user[session.user_id]
+    session.user_id = intern_id(user_id) if user_id is not None else None
+    if session.user_id is not None:
+        _by_user.setdefault(session.user_id, {})[session] = None
+
+def join_room(session, room_id):
+    """Add the session to a room. Returns True if the room was created."""
+    room_id = intern_id(room_id)
+    session.room_id = room_id
+    members = _by_room.get(room_id)
+    created = members is None
+    if created:
+        members = _by_room[room_id] = {}
+    members[session] = None
+    _snapshots.pop(room_id, None)
+    return created
+
+def leave_room(session):
+    """Remove the session from its room. Returns (room_id, room_now_empty), room_id None if not in one."""
+    room_id = session.room_id
+    members = _by_room.get(room_id)
+    if members is None or session not in members:
+        return None, False
+    del members[session]
+    _snapshots.pop(room_id, None)
+    if not members:
+        del _by_room[room_id]
+        return room_id, True
+    return room_id, False
+
+def room_members(room_id):
+    """Members of a room as a tuple that stays valid while the room is mutated.
+
+    The tuple is cached until membership next changes, so repeated broadcasts
+    to a stable room don't copy the member set.
+    """
+    snapshot = _snapshots.get(room_id)
+    if snapshot is None:
+        members = _by_room.get(room_id)
+        if members is None:
+            return ()
+        snapshot = _snapshots[room_id] = tuple(members)
+    return snapshot
+
+def has_room(room_id):
+    return room_id in _by_room
+
+def room_size(room_id):
+    members = _by_room.get(room_id)
+    return len(members) if members else 0
+
+def room_count():
+    return len(_by_room)
+
+def room_users(room_id):
+    """Distinct user ids present in a room."""
+    return {session.user_id for session in _by_room.get(room_id, ())}
+
+def user_sessions(user_id):
+    return tuple(_by_user.get(user_id, ()))
+
+def is_online(user_id):
+    return user_id in _by_user
+
+def connection_count():
+    return len(_sessions)
+
+def all_sessions():
+    return tuple(_sessions.values())
+
+def membership_count():
+    return sum(len(members) for members in _by_room.values())
+
+def session_overhead_bytes():
+    """Approximate registry bytes held per idle session (record plus index slots).
+
+    Socket buffers and the websockets protocol object are not included; the
+    benchmark's RSS-per-connection figure covers the whole footprint.
+    """
+    # One entry each in _sessions, the room index and the user index.
+    return sys.getsizeof(Session(None, None)) + 3 * _DICT_ENTRY_BYTES
@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from .config import RESUME_SECRET, RESUME_TTL
+
+# Resume tokens let a client that was asked to reconnect (drain, restart) rejoin
+# without another Firebase verification. A token names the user, the room and
+# the time the old connection stopped receiving, and is signed with
+# RESUME_SECRET, which every process that may receive the reconnect must share.
+
+_key = RESUME_SECRET.encode() if RESUME_SECRET else None
+
+def enabled():
+    return _key is not None
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def issue(user_id, room_id, since):
+    """Signed token for resuming `room_id` as `user_id`, replaying messages after `since` (ISO)."""
+    body = _b64(json.dumps(
+        {"u": user_id, "r": room_id, "t": since, "e": int(time.time() + RESUME_TTL)},
+        separators=(",", ":"),
+    ).encode())
+    signature = _b64(hmac.new(_key, body.encode(), hashlib.sha256).digest())
+    return f"{body}.{signature}"
+
+def verify(token):
+    """Return (user_id, room_id, since) for a valid, unexpired token, else None."""
+    # Tokens are ASCII; anything else (including lone surrogates, which stdlib
+    # json decodes "\ud800" to and which can't be encoded) is not one of ours.
+    if not enabled() or not isinstance(token, str) or not token.isascii():
+        return None
+    body, _, signature = token.partition(".")
+    expected = _b64(hmac.new(_key, body.encode(), hashlib.sha256).digest())
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        claims = json.loads(_unb64(body))
+    except ValueError:
+        return None
+    if claims.get("e", 0) < time.time():
+        return None
+    return claims["u"], claims["r"], claims["t"]
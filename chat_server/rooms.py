@@ -1,34 +1,50 @@
 import logging
-import json
-import asyncio
+import time
+from . import metrics
+from . import registry
+from .fanout import fan_out
+from .bus import publish
+from . import broker
+from . import history
+from . import presence
+from . import ratelimit
+from . import sequence
 
-ROOMS = {}
+async def register(session, roomId):
+    if registry.join_room(session, roomId):
+        broker.room_opened(session.room_id)
+        sequence.open_room(session.room_id)
+    userId = session.user_id
+    logging.info("User '%s' joined room '%s'", userId, roomId,
+                 extra={"event": "room.join", "userId": userId, "roomId": roomId})
+    presence.user_joined(session.room_id, userId)
 
-async def register(websocket, roomId, userId):
-    if roomId not in ROOMS:
-        ROOMS[roomId] = set()
-    ROOMS[roomId].add(websocket)
-    websocket.room_id = roomId
-    websocket.user_id = userId
-    logging.info(f"User '{userId}' joined room '{roomId}'")
-    announcement = {"type": "announcement", "message": f"User '{userId}' joined the room."}
-    await broadcast(roomId, json.dumps(announcement), exclude_sender=False)
+async def unregister(session):
+    roomId, emptied = registry.leave_room(session)
+    if roomId is None:
+        return
+    userId = session.user_id
+    logging.info("User '%s' left room '%s'", userId, roomId,
+                 extra={"event": "room.leave", "userId": userId, "roomId": roomId})
+    presence.user_left(roomId, userId)
+    if emptied:
+        if broker.room_closed(roomId):
+            # Other nodes' messages stop arriving, so the buffer would go stale.
+            history.forget_room(roomId)
+        ratelimit.forget_room(roomId)
+        sequence.close_room(roomId)
+        logging.info("Room '%s' deleted (empty).", roomId, extra={"event": "room.delete", "roomId": roomId})
 
-async def unregister(websocket):
-    roomId = getattr(websocket, 'room_id', None)
-    userId = getattr(websocket, 'user_id', 'Unknown')
-    if roomId and roomId in ROOMS and websocket in ROOMS[roomId]:
-        ROOMS[roomId].remove(websocket)
-        logging.info(f"User '{userId}' left room '{roomId}'")
-        announcement = {"type": "announcement", "message": f"User '{userId}' left the room."}
-        await broadcast(roomId, json.dumps(announcement), exclude_sender=False)
-        if not ROOMS[roomId]:
-            del ROOMS[roomId]
-            logging.info(f"Room '{roomId}' deleted (empty).")
+async def broadcast(roomId, message, exclude_sender=True, sender=None):
+    deliver_local(roomId, message, exclude=sender if exclude_sender else None)
+    # Members connected to sibling workers or other nodes get it over the bus/broker.
+    publish(roomId, message)
+    broker.publish(roomId, message)
 
-async def broadcast(roomId, message, exclude_sender=True, sender_websocket=None):
-    if roomId in ROOMS:
-        clients = list(ROOMS[roomId])
-        tasks = [client.send(message) for client in clients if not (exclude_sender and client == sender_websocket)]
-        if tasks:
-            await asyncio.gather(*tasks)
+def deliver_local(roomId, message, exclude=None):
+    members = registry.room_members(roomId)
+    if members:
+        # Encoded once per codec and queued on each member's outbox; slow sockets can't stall the sender.
+        started = time.perf_counter()
+        fan_out(members, message, exclude=exclude)
+        metrics.BROADCAST_SECONDS.observe(time.perf_counter() - started)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from . import db
+from .config import SEQ_BLOCK_SIZE, SEQ_RESERVE_RETRY_MS
+
+# Per-room message sequence numbers, assigned in memory at broadcast time and
+# persisted with the row. Each process reserves blocks of SEQ_BLOCK_SIZE numbers
+# from the room's counter in room_seqs (db.reserve_seqs) and keeps the next block
+# reserved in the background, so sending a message never waits on the database.
+#
+# Numbers are unique across workers and nodes and increase within a process.
+# When another process's number overtakes our block (seen via observe), we move
+# on to a newer block; until one arrives, senders on different nodes can briefly
+# interleave out of order. Numbers left in a block when a process exits or a
+# room empties are never used, so the sequence has holes.
+#
+# If no block could be reserved (the database is down when a room opens), the
+# message goes out without a seq rather than not at all.
+
+class _Room:
+    __slots__ = ("next", "end", "spare", "floor", "reserving")
+
+    def __init__(self):
+        self.next = self.end = 0  # current block: next .. end - 1
+        self.spare = None         # (start, end) of the block to use next
+        self.floor = 0            # highest seq seen from another process
+        self.reserving = None     # task reserving a block
+
+_rooms = {}
+
+stats = {"reserved": 0, "reserve_errors": 0, "stale_blocks": 0, "unsequenced": 0}
+
+def open_room(roomId):
+    """Start reserving a room's first block before anyone sends to it."""
+    _refill(roomId, _room(roomId))
+
+def close_room(roomId):
+    """Forget a room's counter once it has no local members."""
+    _rooms.pop(roomId, None)
+
+def _room(roomId):
+    room = _rooms.get(roomId)
+    if room is None:
+        room = _rooms[roomId] = _Room()
+    return room
+
+def next_seq(roomId):
+    """Allocate the room's next sequence number, or None if no block is reserved."""
+    room = _room(roomId)
+    if room.spare is not None and (room.next >= room.end or room.end <= room.floor):
+        if room.next < room.end:
+            stats["stale_blocks"] += 1
+        room.next, room.end = room.spare
+        room.spare = None
+    if room.spare is None:
+        _refill(roomId, room)
+    if room.next >= room.end:
+        stats["unsequenced"] += 1
+        return None
+    seq = room.next
+    room.next += 1
+    return seq
+
+def observe(roomId, seq):
+    """Note a sequence number assigned by another worker or node."""
+    room = _rooms.get(roomId)
+    if room is not None and seq is not None and seq > room.floor:
+        room.floor = seq
+
+def _refill(roomId, room):
+    if room.reserving is None:
+        room.reserving = asyncio.ensure_future(_reserve(roomId, room))
+
+async def _reserve(roomId, room):
+    start = None
+    try:
+        while start is None and _rooms.get(roomId) is room:
+            try:
+                start = await db.reserve_seqs(roomId, SEQ_BLOCK_SIZE)
+            except Exception as e:
+                stats["reserve_errors"] += 1
+                logging.error(f"Could not reserve sequence numbers for room '{roomId}': {e}")
+                await asyncio.sleep(SEQ_RESERVE_RETRY_MS / 1000)
+    finally:
+        room.reserving = None
+    if start is None:
+        return
+    stats["reserved"] += 1
+    block = (start, start + SEQ_BLOCK_SIZE)
+    if room.next >= room.end or room.end <= room.floor:
+        if room.next < room.end:
+            stats["stale_blocks"] += 1
+        room.next, room.end = block
+        if room.spare is None:
+            # Keep one block in hand, so the next message doesn't find the counter empty.
+            _refill(roomId, room)
+    else:
+        room.spare = block
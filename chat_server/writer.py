@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from .config import (
+    WRITE_QUEUE_MAX, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL_MS,
+    WRITE_RETRY_BASE_MS, WRITE_RETRY_MAX_MS, WRITE_STOP_TIMEOUT,
+)
+from .db import save_messages_batch
+
+# Write-behind persistence: handle_message enqueues rows here and a single
+# background task flushes them to the DB in batches. A batch is retried until
+# the database takes it; rows are only dropped if the database rejects them.
+_queue = None
+_writer_task = None
+_batch_ready = None
+
+stats = {
+    "enqueued": 0,
+    "written": 0,
+    "failed": 0,
+    "retries": 0,
+    "batches": 0,
+    "last_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+    "total_flush_ms": 0.0,
+}
+
+def start_writer():
+    global _queue, _writer_task, _batch_ready
+    _queue = asyncio.Queue(maxsize=WRITE_QUEUE_MAX)
+    _batch_ready = asyncio.Event()
+    _writer_task = asyncio.create_task(_writer_loop())
+    return _writer_task
+
+async def enqueue_message(roomId, userId, text, timestamp, seq):
+    """Queue a message for persistence. Waits (backpressure) while the queue is full.
+
+    The broadcast timestamp is stored as-is so cached and persisted copies agree.
+    """
+    await _queue.put((roomId, userId, text, timestamp, seq))
+    stats["enqueued"] += 1
+    if _queue.qsize() >= WRITE_BATCH_SIZE - 1:
+        _batch_ready.set()
+
+def queue_depth():
+    return _queue.qsize() if _queue else 0
+
+def get_writer_stats():
+    batches = stats["batches"]
+    return {
+        **stats,
+        "queue_depth": queue_depth(),
+        "avg_flush_ms": stats["total_flush_ms"] / batches if batches else 0.0,
+    }
+
+async def _save(batch):
+    """Store a batch, retrying with backoff while the database is unavailable."""
+    delay = WRITE_RETRY_BASE_MS / 1000
+    while True:
+        try:
+            return await save_messages_batch(batch)
+        except Exception as e:
+            stats["retries"] += 1
+            logging.warning(f"Saving {len(batch)} messages failed ({e!r}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WRITE_RETRY_MAX_MS / 1000)
+
+async def _flush(batch):
+    started = time.perf_counter()
+    try:
+        saved = await _save(batch)
+    finally:
+        for _ in batch:
+            _queue.task_done()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats["batches"] += 1
+    stats["last_flush_ms"] = elapsed_ms
+    stats["max_flush_ms"] = max(stats["max_flush_ms"], elapsed_ms)
+    stats["total_flush_ms"] += elapsed_ms
+    stats["written"] += saved
+    stats["failed"] += len(batch) - saved
+
+async def _writer_loop():
+    interval = WRITE_FLUSH_INTERVAL_MS / 1000
+    while True:
+        batch = [await _queue.get()]
+        # Wait for either a full batch or the flush interval, whichever comes first.
+        if _queue.qsize() + 1 < WRITE_BATCH_SIZE:
+            _batch_ready.clear()
+            try:
+                await asyncio.wait_for(_batch_ready.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+        while len(batch) < WRITE_BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+        try:
+            await _flush(batch)
+        except Exception as e:
+            logging.error(f"Message writer flush failed: {e}")
+
+async def stop_writer():
+    """Flush everything still queued, then stop the writer task."""
+    global _writer_task
+    if _queue is None:
+        return
+    pending = queue_depth()
+    if pending:
+        logging.info(f"Flushing {pending} pending messages to DB...")
+    try:
+        await asyncio.wait_for(_queue.join(), WRITE_STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        unsaved = stats["enqueued"] - stats["written"] - stats["failed"]
+        logging.error(f"Gave up flushing after {WRITE_STOP_TIMEOUT}s; {unsaved} messages were not saved")
+    if _writer_task:
+        _writer_task.cancel()
+        try:
+            await _writer_task
+        except asyncio.CancelledError:
+            pass
+        _writer_task = None
+    logging.info(f"Message writer stopped: {get_writer_stats()}")
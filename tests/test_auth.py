@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+import pytest
+
+pytest.importorskip("google.auth")
+
+from chat_server import auth
+from chat_server.fake_keyserver import FakeKeyServer
+
+PROJECT_ID = "demo-project"
+
+
+@pytest.fixture
+def keyserver(monkeypatch):
+    server = FakeKeyServer(PROJECT_ID, max_age=120).start()
+    monkeypatch.setattr(auth, "FIREBASE_PROJECT_ID", PROJECT_ID)
+    monkeypatch.setattr(auth, "FIREBASE_CERTS_URL", server.url)
+    monkeypatch.setattr(auth, "_ISSUER", f"https://securetoken.google.com/{PROJECT_ID}")
+    monkeypatch.setattr(auth, "_certs", None)
+    monkeypatch.setattr(auth, "_certs_expiry", 0.0)
+    monkeypatch.setattr(auth, "_certs_fetched_at", 0.0)
+    monkeypatch.setattr(auth, "_certs_lock", None)
+    monkeypatch.setattr(auth, "_verified", OrderedDict())
+    monkeypatch.setattr(auth, "_inflight", {})
+    monkeypatch.setattr(auth, "stats", dict.fromkeys(auth.stats, 0))
+    yield server
+    server.stop()
+
+
+def _verify(*tokens):
+    async def run():
+        return [await auth.verify_firebase_token(token) for token in tokens]
+    return asyncio.run(run())
+
+
+def test_valid_token_is_verified_once_then_served_from_cache(keyserver):
+    token = keyserver.mint_token("alice")
+    first, second = _verify(token, token)
+    assert first["user_id"] == second["user_id"] == "alice"
+    assert auth.stats["misses"] == 1
+    assert auth.stats["hits"] == 1
+    assert keyserver.requests == 1
+
+
+def test_cached_claims_are_dropped_once_the_token_expires(keyserver):
+    token = keyserver.mint_token("alice", lifetime=1)
+    assert _verify(token)[0]["user_id"] == "alice"
+    time.sleep(max(0.0, auth._verified[hashlib.sha256(token.encode()).digest()]["exp"] - time.time()) + 0.1)
+    # Re-verified rather than served from the cache (google-auth itself allows some clock skew).
+    _verify(token)
+    assert auth.stats["hits"] == 0
+    assert auth.stats["misses"] == 2
+
+
+def test_concurrent_verifications_of_one_token_share_one_attempt(keyserver):
+    token = keyserver.mint_token("alice")
+
+    async def run():
+        return await asyncio.gather(*(auth.verify_firebase_token(token) for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert all(claims["user_id"] == "alice" for claims in results)
+    assert auth.stats["misses"] == 1
+    assert auth.stats["coalesced"] == 9
+    assert keyserver.requests == 1
+
+
+def _bad_signature(server):
+    header, payload, signature = server.mint_token("alice").split(".")
+    return ".".join([header, payload, signature[::-1]])
+
+
+@pytest.mark.parametrize("make_token", [
+    _bad_signature,
+    lambda server: server.mint_token("alice", iss="https://securetoken.google.com/someone-else"),
+    lambda server: server.mint_token("alice", aud="someone-else"),
+    lambda server: "not.a.token",
+    lambda server: "",
+    lambda server: 42,
+    lambda server: "\ud800." + server.mint_token("alice"),
+], ids=["bad-signature", "wrong-iss", "wrong-aud", "malformed", "empty", "not-a-string", "lone-surrogate"])
+def test_invalid_tokens_are_rejected(keyserver, make_token):
+    assert _verify(make_token(keyserver)) == [None]
+    assert not auth._verified
+
+
+def test_certs_are_cached_for_their_max_age(keyserver):
+    _verify(keyserver.mint_token("alice"), keyserver.mint_token("bob"))
+    assert keyserver.requests == 1
+    assert auth._certs_expiry == pytest.approx(auth._certs_fetched_at + 120)
+
+    # Once max-age has passed, the next verification refetches.
+    auth._certs_expiry = time.time() - 1
+    _verify(keyserver.mint_token("carol"))
+    assert keyserver.requests == 2
+
+
+def test_certs_are_refetched_when_the_signing_key_rotates(keyserver, monkeypatch):
+    assert _verify(keyserver.mint_token("alice"))[0]["user_id"] == "alice"
+    keyserver.rotate()
+
+    # Forced refetches are rate-limited; a rotation right after a fetch is still refused.
+    assert _verify(keyserver.mint_token("bob")) == [None]
+    assert keyserver.requests == 1
+
+    monkeypatch.setattr(auth, "_MIN_FORCED_REFRESH", 0)
+    assert _verify(keyserver.mint_token("carol"))[0]["user_id"] == "carol"
+    assert keyserver.requests == 2
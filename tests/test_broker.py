@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+from chat_server import broker, db, memory_db, registry, rooms
+from chat_server.codec import codec_for
+
+
+class RecordingOutbox:
+    shared_key = None
+
+    def __init__(self):
+        self.payloads = []
+
+    def push(self, frame):
+        self.payloads.append(json.loads(frame[1]))
+
+    def messages(self):
+        return [payload["text"] for payload in self.payloads if payload.get("type") == "message"]
+
+
+def _session(user_id):
+    session = registry.open_session(object(), codec_for(None))
+    registry.set_user(session, user_id)
+    session.outbox = RecordingOutbox()
+    return session
+
+
+async def _settle(*nodes):
+    for node in nodes:
+        await node.flush()
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    monkeypatch.setattr(db, "reserve_seqs", memory_db.reserve_seqs, raising=False)
+    return broker.LocalHub()
+
+
+def _node(hub, received):
+    return broker.Node(broker.LocalBroker(hub), lambda roomId, message: received.append((roomId, message)))
+
+
+def test_two_nodes_on_one_hub_deliver_to_each_other_but_not_to_themselves(hub):
+    a_received, b_received = [], []
+
+    async def run():
+        a, b = _node(hub, a_received), _node(hub, b_received)
+        await a.start()
+        await b.start()
+        a.room_opened("r")
+        b.room_opened("r")
+        await _settle(a, b)
+        a.publish("r", {"type": "message", "text": "from a"})
+        b.publish("r", {"type": "message", "text": "from b"})
+        await _settle(a, b)
+        await a.stop()
+        await b.stop()
+
+    own_echoes = broker.stats["own_echoes"]
+    asyncio.run(run())
+    assert a_received == [("r", {"type": "message", "text": "from b"})]
+    assert b_received == [("r", {"type": "message", "text": "from a"})]
+    assert broker.stats["own_echoes"] == own_echoes + 2
+
+
+def test_nodes_only_hear_rooms_they_have_members_in(hub, monkeypatch):
+    """rooms.register/unregister drive node A's subscriptions; broadcasts reach local members directly."""
+    b_received, a_received = [], []
+
+    async def run():
+        a, b = _node(hub, a_received), _node(hub, b_received)
+        await a.start()
+        await b.start()
+        monkeypatch.setattr(broker, "_node", a)
+        alice, carol = _session("alice"), _session("carol")
+        await rooms.register(alice, "open")
+        await rooms.register(carol, "open")
+        b.room_opened("open")
+        await _settle(a, b)
+        assert set(hub.channels) == {broker.CHANNEL_PREFIX + "open"}
+
+        await rooms.broadcast("open", {"type": "message", "text": "hi"}, sender=alice)
+        # Another node's message for a room A has no members in never reaches A.
+        b.publish("elsewhere", {"type": "message", "text": "not for a"})
+        b.publish("open", {"type": "message", "text": "for a"})
+        await _settle(a, b)
+        received_by_carol = carol.outbox.messages()
+
+        await rooms.unregister(alice)
+        await rooms.unregister(carol)
+        await _settle(a, b)
+        b.publish("open", {"type": "message", "text": "after leaving"})
+        await _settle(a, b)
+        await a.stop()
+        await b.stop()
+        registry.close_session(alice)
+        registry.close_session(carol)
+        return received_by_carol
+
+    received_by_carol = asyncio.run(run())
+    # Delivered once, straight from the registry: the echo from the broker is dropped.
+    assert received_by_carol == ["hi"]
+    assert b_received == [("open", {"type": "message", "text": "hi"})]
+    assert a_received == [("open", {"type": "message", "text": "for a"})]
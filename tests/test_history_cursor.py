@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, UTC
+
+import pytest
+
+from chat_server import db, memory_db
+
+
+def test_cached_messages_get_seq_cursors():
+    timestamp = datetime(2026, 1, 1, tzinfo=UTC).isoformat()
+    page = db.page_from_messages([
+        {"userId": "u", "text": "b", "timestamp": timestamp, "seq": 8},
+        {"userId": "u", "text": "a", "timestamp": timestamp, "seq": 7},
+    ])
+    assert db.decode_cursor(page["nextCursor"]) == (datetime.fromisoformat(timestamp), None, 7)
+    assert db.decode_cursor(page["prevCursor"]) == (datetime.fromisoformat(timestamp), None, 8)
+
+
+def test_stored_and_legacy_cursors_still_decode():
+    timestamp = datetime(2026, 1, 1, tzinfo=UTC)
+    assert db.decode_cursor(db.encode_cursor(timestamp.isoformat(), 12)) == (timestamp, 12, None)
+    assert db.decode_cursor(timestamp.isoformat()) == (timestamp, None, None)
+
+
+def test_memory_db_pages_from_a_seq_cursor():
+    timestamp = datetime(2026, 1, 1, tzinfo=UTC)
+
+    async def run():
+        await memory_db.save_messages_batch(
+            [("cursor-room", "u", f"m{seq}", timestamp, seq) for seq in range(1, 6)]
+        )
+        cursor = db.encode_seq_cursor(timestamp.isoformat(), 4)
+        return (
+            await memory_db.fetch_messages_page("cursor-room", before=cursor, limit=2),
+            await memory_db.fetch_messages_page("cursor-room", after=cursor),
+        )
+
+    older, newer = asyncio.run(run())
+    assert [m["seq"] for m in older["messages"]] == [3, 2]
+    assert [m["seq"] for m in newer["messages"]] == [5]
+
+
+def test_cursor_pages_merge_the_buffer_with_stored_messages(monkeypatch):
+    from chat_server import history
+
+    monkeypatch.setattr(history, "_rooms", history.OrderedDict())
+    monkeypatch.setattr(history, "fetch_messages_keyset", memory_db.fetch_messages_keyset)
+    times = [datetime(2026, 1, 1, 0, minute, tzinfo=UTC) for minute in range(8)]
+
+    async def run():
+        # 1-5 are stored; 4-7 were broadcast since the buffer started, 6 and 7 are still queued.
+        await memory_db.save_messages_batch([("merge-room", "u", f"m{seq}", times[seq], seq) for seq in range(1, 6)])
+        for seq in range(4, 8):
+            history.record_message("merge-room", {"userId": "u", "text": f"m{seq}", "timestamp": times[seq].isoformat(), "seq": seq})
+        first = await history.load_history("merge-room", limit=2)
+        older = await history.load_history("merge-room", before=first["nextCursor"], limit=4)
+        newer = await history.load_history("merge-room", after=older["nextCursor"], limit=3)
+        missed = await history.replay("merge-room", times[1].isoformat(), times[7].isoformat(), 10)
+        return first, older, newer, missed
+
+    first, older, newer, missed = asyncio.run(run())
+    assert [m["seq"] for m in first["messages"]] == [7, 6]
+    assert [m["seq"] for m in older["messages"]] == [5, 4, 3, 2]
+    assert [m["seq"] for m in newer["messages"]] == [5, 4, 3]
+    assert [m["seq"] for m in missed["messages"]] == [7, 6, 5, 4, 3, 2]
+
+
+@pytest.mark.parametrize("cursor", [5, None, b"abc", "garbage", "2026-01-01T00:00:00", db.encode_cursor("2026-01-01T00:00:00+00:00", "x")])
+def test_malformed_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        db.decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("cursor", [5, "garbage"])
+def test_memory_db_answers_malformed_cursors_with_an_empty_page(cursor):
+    page = asyncio.run(memory_db.fetch_messages_keyset("cursor-room", before=cursor))
+    assert page == {"messages": [], "nextCursor": None, "prevCursor": None}
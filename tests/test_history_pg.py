@@ -0,0 +1,109 @@
+"""History queries against a real Postgres.
+
+Runs when TEST_DATABASE_URL (or DATABASE_URL) points at a server the tests may
+create a scratch database on; skipped otherwise.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+from chat_server import db, migrations, partitions
+
+DSN = os.getenv("TEST_DATABASE_URL") or os.getenv("DATABASE_URL")
+ROOMS = 20
+ROWS_PER_ROOM = 1000
+
+
+async def _admin(statement):
+    conn = await asyncpg.connect(DSN, timeout=5)
+    try:
+        await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+async def _setup(database):
+    await _admin(f'CREATE DATABASE "{database}"')
+    pool = await asyncpg.create_pool(DSN, database=database, min_size=1, max_size=2)
+    try:
+        await migrations.migrate(pool)
+        await partitions.maintain(pool, retire=False)
+        now = datetime.now(UTC)
+        # Spread over the legacy partition and the daily ones after it.
+        records = [
+            (f"room-{room}", f"user-{i % 7}", f"message {i}", now + timedelta(minutes=5 * i - 2880), i + 1)
+            for room in range(ROOMS)
+            for i in range(ROWS_PER_ROOM)
+        ]
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                "messages", records=records, columns=["roomid", "userid", "text", "timestamp", "seq"]
+            )
+    finally:
+        await pool.close()
+
+
+@pytest.fixture(scope="module")
+def database():
+    if not DSN:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    try:
+        asyncio.run(_admin("SELECT 1"))
+    except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+        pytest.skip(f"Postgres is not reachable: {e}")
+    name = f"chat_test_{uuid.uuid4().hex[:8]}"
+    asyncio.run(_setup(name))
+    yield name
+    asyncio.run(_admin(f'DROP DATABASE IF EXISTS "{name}"'))
+
+
+def _with_pool(database, body):
+    async def run():
+        pool = await asyncpg.create_pool(DSN, database=database, min_size=1, max_size=2)
+        try:
+            return await body(pool)
+        finally:
+            await pool.close()
+    return asyncio.run(run())
+
+
+def test_history_query_is_index_only_scan_of_covering_index(database):
+    async def body(pool):
+        node = await migrations.explain_history_query(pool, "room-3", datetime.now(UTC) + timedelta(days=3))
+        return migrations.scan_nodes(node), await migrations.history_plan_problems(pool, node)
+
+    scans, problems = _with_pool(database, body)
+    assert any(scan["Node Type"] == "Index Only Scan" for scan in scans)
+    assert problems == []
+
+
+def test_seq_cursor_pages_past_messages_with_the_same_timestamp(database):
+    timestamp = datetime(2026, 1, 1, tzinfo=UTC) + timedelta(days=1)
+
+    async def body(pool):
+        async with pool.acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO messages (roomId, userId, text, timestamp, seq) VALUES ($1, $2, $3, $4, $5)",
+                [("same-ts", "u", f"m{seq}", timestamp, seq) for seq in range(1, 6)],
+            )
+        db.db_pool = pool
+        try:
+            # The newest message as the broadcast cache serves it: no id yet.
+            cached = {"userId": "u", "text": "m5", "timestamp": timestamp.isoformat(), "seq": 5}
+            page = db.page_from_messages([cached])
+            older = await db.fetch_messages_page("same-ts", before=page["nextCursor"], limit=2)
+            newer = await db.fetch_messages_page("same-ts", after=db.page_from_messages(
+                [{**cached, "seq": 3}]
+            )["prevCursor"], limit=10)
+            return older, newer
+        finally:
+            db.db_pool = None
+
+    older, newer = _with_pool(database, body)
+    assert [m["seq"] for m in older["messages"]] == [4, 3]
+    assert [m["seq"] for m in newer["messages"]] == [5, 4]
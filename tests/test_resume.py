@@ -0,0 +1,23 @@
+import pytest
+
+from chat_server import resume
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(resume, "_key", b"test-secret")
+
+
+def test_issued_tokens_verify():
+    token = resume.issue("alice", "room", "2026-01-01T00:00:00+00:00")
+    assert resume.verify(token) == ("alice", "room", "2026-01-01T00:00:00+00:00")
+
+
+@pytest.mark.parametrize("mangle", [
+    lambda token: token[:-2] + ("AA" if not token.endswith("AA") else "BB"),
+    lambda token: token + "é",
+    lambda token: token + "\ud800",
+    lambda token: "\ud800." + token.partition(".")[2],
+], ids=["bad-signature", "non-ascii", "lone-surrogate", "lone-surrogate-body"])
+def test_tampered_tokens_are_rejected(mangle):
+    assert resume.verify(mangle(resume.issue("alice", "room", "2026-01-01T00:00:00+00:00"))) is None
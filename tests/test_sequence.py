@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from chat_server import db, sequence
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    """A room_seqs stand-in shared by every 'process' in the test; fails while .down is set."""
+    class Counter:
+        last = 0
+        down = False
+        calls = 0
+
+        async def reserve(self, roomId, count):
+            self.calls += 1
+            if self.down:
+                raise ConnectionError("database is down")
+            self.last += count
+            return self.last - count + 1
+
+    counter = Counter()
+    monkeypatch.setattr(db, "reserve_seqs", counter.reserve, raising=False)
+    monkeypatch.setattr(sequence, "SEQ_BLOCK_SIZE", 3)
+    monkeypatch.setattr(sequence, "SEQ_RESERVE_RETRY_MS", 10)
+    monkeypatch.setattr(sequence, "_rooms", {})
+    return counter
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_seqs_are_assigned_in_memory_across_blocks(counter):
+    async def run():
+        sequence.open_room("r")
+        await _settle()
+        seqs = []
+        for _ in range(7):
+            seqs.append(sequence.next_seq("r"))
+            await _settle()
+        return seqs
+
+    assert asyncio.run(run()) == [1, 2, 3, 4, 5, 6, 7]
+    # One block in use and one in hand: far fewer round trips than messages.
+    assert counter.calls == 4
+
+
+def test_another_process_overtaking_moves_on_to_a_newer_block(counter):
+    async def run():
+        sequence.open_room("r")
+        await _settle()
+        first = sequence.next_seq("r")
+        # Another node reserved 7..9 and used 7.
+        counter.last += 3
+        sequence.observe("r", 7)
+        # The spare block (4..6) is behind too, so use it only until a newer one arrives.
+        interim = sequence.next_seq("r")
+        await _settle()
+        return first, interim, sequence.next_seq("r")
+
+    first, interim, after = asyncio.run(run())
+    assert first == 1
+    assert interim == 4
+    assert after > 7
+
+
+def test_messages_go_out_unsequenced_while_no_block_can_be_reserved(counter):
+    counter.down = True
+
+    async def run():
+        sequence.open_room("r")
+        await _settle()
+        during = sequence.next_seq("r")
+        counter.down = False
+        await asyncio.sleep(0.05)
+        return during, sequence.next_seq("r")
+
+    during, after = asyncio.run(run())
+    assert during is None
+    assert after == 1